@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+Benchmarks for selectors, traversals and set operations.
+
+Runs against the in-process lxml browser, with a generated page, so no
+real browser is needed.  Reports the best wall time of several runs,
+and the number of commands each benchmark sent to the browser.
+
+    python benchmarks.py
+    python benchmarks.py --sizes 1000,10000 --repeat 5 traversal
+
+Requires lxml and cssselect.
+"""
+from optparse import OptionParser
+import json
+import time
+
+import webdriverplus
+from webdriverplus.lxmldriver import LxmlConnection
+from webdriverplus.orderedset import OrderedSet
+
+
+class CountingConnection(LxmlConnection):
+    """
+    Counts the commands sent to the lxml browser.
+    """
+    def __init__(self, content):
+        LxmlConnection.__init__(self)
+        self._load('about:blank', content)
+        self.commands = 0
+
+    def execute(self, command, params):
+        self.commands += 1
+        return LxmlConnection.execute(self, command, params)
+
+
+def make_page(size):
+    """
+    A page with roughly `size` elements: lists of ten items each.
+    """
+    lists = []
+    for idx in range(max(size / 11, 1)):
+        items = ''.join(['<li class="item%s" data-n="%d">%d</li>' %
+                         (n % 2 and ' odd' or '', n, n) for n in range(10)])
+        lists.append('<ul id="list%d" class="list">%s</ul>' % (idx, items))
+    return '<html><body>%s</body></html>' % ''.join(lists)
+
+
+def make_driver(size):
+    executor = CountingConnection(make_page(size))
+    driver = webdriverplus.Remote(command_executor=executor,
+                                  desired_capabilities={})
+    return driver, executor
+
+
+# Each benchmark takes (driver, size) and returns a function to be timed.
+def bench_find(driver, size):
+    return lambda: driver.find('li')
+
+
+def bench_find_keywords(driver, size):
+    return lambda: driver.find(tag_name='li', class_name='odd',
+                               attribute_value=('data-n', '5'))
+
+
+def bench_find_keywords_xpath(driver, size):
+    return lambda: driver.find('li', class_name='odd', text='5')
+
+
+def bench_set_find(driver, size):
+    lists = driver.find('ul')
+    return lambda: lists.find('li.odd')
+
+
+def bench_traversal_parent(driver, size):
+    items = driver.find('li')
+    return lambda: items.parent()
+
+
+def bench_traversal_children(driver, size):
+    lists = driver.find('ul')
+    return lambda: lists.children()
+
+
+def bench_traversal_siblings(driver, size):
+    items = driver.find('li.odd')
+    return lambda: items.siblings()
+
+
+def bench_traversal_next(driver, size):
+    items = driver.find('li')
+    return lambda: items.next()
+
+
+def bench_filter(driver, size):
+    items = driver.find('li')
+    return lambda: items.filter('.odd')
+
+
+def bench_exclude_keywords(driver, size):
+    items = driver.find('li')
+    return lambda: items.exclude(text='5')
+
+
+def bench_count(driver, size):
+    return lambda: driver.count('li')
+
+
+def bench_orderedset_union(driver, size):
+    first, second = OrderedSet(range(size)), range(size / 2, size + size / 2)
+    return lambda: first | second
+
+
+def bench_orderedset_intersection(driver, size):
+    first, second = OrderedSet(range(size)), range(size / 2, size + size / 2)
+    return lambda: first & second
+
+
+def bench_orderedset_difference(driver, size):
+    first, second = OrderedSet(range(size)), range(size / 2, size + size / 2)
+    return lambda: first - second
+
+
+def bench_unwrap_elements(driver, size):
+    refs = json.dumps([{'ELEMENT': str(idx)} for idx in range(size)])
+    return lambda: driver._unwrap_value(json.loads(refs))
+
+
+def bench_unwrap_table(driver, size):
+    rows = json.dumps([['cell'] * 10 for idx in range(size / 10)])
+    return lambda: driver._unwrap_value(json.loads(rows))
+
+
+BENCHMARKS = [
+    ('find', bench_find),
+    ('find_keywords', bench_find_keywords),
+    ('find_keywords_xpath', bench_find_keywords_xpath),
+    ('set_find', bench_set_find),
+    ('traversal_parent', bench_traversal_parent),
+    ('traversal_children', bench_traversal_children),
+    ('traversal_siblings', bench_traversal_siblings),
+    ('traversal_next', bench_traversal_next),
+    ('filter', bench_filter),
+    ('exclude_keywords', bench_exclude_keywords),
+    ('count', bench_count),
+    ('orderedset_union', bench_orderedset_union),
+    ('orderedset_intersection', bench_orderedset_intersection),
+    ('orderedset_difference', bench_orderedset_difference),
+    ('unwrap_elements', bench_unwrap_elements),
+    ('unwrap_table', bench_unwrap_table),
+]
+
+
+def run(sizes, repeat, names=None):
+    """
+    Runs the benchmarks, returning a list of (name, size, seconds, commands).
+    `seconds` is the best of `repeat` runs, and `commands` is the number of
+    commands sent to the browser by a single run.
+    """
+    results = []
+    for size in sizes:
+        driver, executor = make_driver(size)
+        for name, bench in BENCHMARKS:
+            if names and not [part for part in names if part in name]:
+                continue
+            func = bench(driver, size)
+            best = None
+            for idx in range(repeat):
+                before = executor.commands
+                start = time.time()
+                func()
+                elapsed = time.time() - start
+                commands = executor.commands - before
+                best = elapsed if best is None else min(best, elapsed)
+            results.append((name, size, best, commands))
+    return results
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] [benchmark names...]')
+    parser.add_option('--sizes', default='1000,10000,100000',
+                      help='Comma separated page sizes, in elements.')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='Number of runs of each benchmark.')
+    options, names = parser.parse_args()
+    sizes = [int(size) for size in options.sizes.split(',')]
+
+    print '%-26s %8s %12s %9s' % ('benchmark', 'size', 'time (ms)', 'commands')
+    for name, size, seconds, commands in run(sizes, options.repeat, names):
+        print '%-26s %8d %12.2f %9d' % (name, size, seconds * 1000, commands)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,28 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import BaseHTTPServer
+import json
+import SocketServer
 import sys
+import threading
+import time
 import unittest
+import urllib2
 
 import webdriverplus
+from webdriverplus.orderedset import OrderedSet
+from webdriverplus.pool import BrowserPool
+from webdriverplus.selectors import LRUCache, SelectorMixin
+from webdriverplus.server import PageServer
+from webdriverplus.asynchronous import AsyncWebDriver, Executor, gather
+from webdriverplus.helpers import _HELPERS_VERSION
+from webdriverplus.webdriver import _LocalState
+from webdriverplus.webelementset import WebElementSet
+from webdriverplus.transport import PooledConnection
+from selenium.webdriver.remote.command import Command
+from selenium.common.exceptions import StaleElementReferenceException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 
 # WebElements as set
 
@@ -41,10 +59,10 @@ if run_slow_tests:
         # TODO: Similar tests, but with multiple windows open.
 
         def setUp(self):
-            webdriverplus.WebDriver._pool.pop('firefox', None)
+            webdriverplus.WebDriver._pool.clear()
 
         def tearDown(self):
-            for browser, signature in webdriverplus.WebDriver._pool.values():
+            for browser in webdriverplus.WebDriver._pool.drivers():
                 browser.quit(force=True)
 
         def test_reuse_browser_set(self):
@@ -59,6 +77,505 @@ if run_slow_tests:
             other = webdriverplus.WebDriver('firefox')
             self.assertNotEquals(browser, other)
 
+        def test_reuse_browser_concurrent(self):
+            browser = webdriverplus.WebDriver('firefox', reuse_browser=True)
+            other = webdriverplus.WebDriver('firefox', reuse_browser=True)
+            self.assertNotEquals(browser, other)
+            other.quit()
+            browser.quit()
+            self.assertEquals(len(webdriverplus.WebDriver._pool.drivers()), 2)
+
+        def test_reuse_browser_resets_state(self):
+            browser = webdriverplus.WebDriver('firefox', reuse_browser=True)
+            browser.open('<p>hi</p>')
+            browser.execute_script("window.open('about:blank')")
+            browser.quit()
+            other = webdriverplus.WebDriver('firefox', reuse_browser=True)
+            self.assertEquals(browser, other)
+            self.assertEquals(len(other.window_handles), 1)
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self._pool = None
+        self.has_quit = False
+
+    def reset(self):
+        pass
+
+    def quit(self, force=False):
+        if self._pool is not None and not force:
+            self._pool.checkin(self)
+            return
+        if self._pool is not None:
+            self._pool.discard(self)
+        self.has_quit = True
+
+
+class BrowserPoolTests(unittest.TestCase):
+    key = ('firefox', (), {'reuse_browser': True})
+
+    def test_checkout_reuses_returned_instance(self):
+        pool = BrowserPool()
+        driver = pool.checkout(self.key, FakeDriver)
+        driver.quit()
+        self.assertTrue(pool.checkout(self.key, FakeDriver) is driver)
+
+    def test_checkout_is_exclusive(self):
+        pool = BrowserPool()
+        driver = pool.checkout(self.key, FakeDriver)
+        other = pool.checkout(self.key, FakeDriver)
+        self.assertFalse(driver is other)
+        self.assertEquals(len(pool.drivers()), 2)
+
+    def test_keys_are_pooled_separately(self):
+        pool = BrowserPool()
+        driver = pool.checkout(self.key, FakeDriver)
+        driver.quit()
+        other = pool.checkout(('chrome', (), {}), FakeDriver)
+        self.assertFalse(driver is other)
+        self.assertFalse(driver.has_quit)
+
+    def test_max_size(self):
+        pool = BrowserPool(max_size=2, timeout=0.1)
+        pool.checkout(self.key, FakeDriver)
+        pool.checkout(self.key, FakeDriver)
+        self.assertRaises(Exception, pool.checkout, self.key, FakeDriver)
+
+    def test_max_size_waits_for_checkin(self):
+        pool = BrowserPool(max_size=1, timeout=5)
+        driver = pool.checkout(self.key, FakeDriver)
+        threading.Timer(0.1, driver.quit).start()
+        self.assertTrue(pool.checkout(self.key, FakeDriver) is driver)
+
+    def test_idle_timeout(self):
+        pool = BrowserPool(idle_timeout=0.01)
+        driver = pool.checkout(self.key, FakeDriver)
+        driver.quit()
+        time.sleep(0.05)
+        self.assertFalse(pool.checkout(self.key, FakeDriver) is driver)
+        self.assertTrue(driver.has_quit)
+
+    def test_prewarm(self):
+        pool = BrowserPool()
+        threads = pool.prewarm(self.key, FakeDriver, count=3)
+        for thread in threads:
+            thread.join()
+        self.assertEquals(len(pool.drivers()), 3)
+        driver = pool.checkout(self.key, lambda: self.fail('Not prewarmed'))
+        self.assertTrue(driver in pool.drivers())
+
+    def test_checkout_waits_for_prewarm(self):
+        def slow_start():
+            time.sleep(0.1)
+            return FakeDriver()
+        pool = BrowserPool()
+        pool.prewarm(self.key, slow_start, count=1)
+        driver = pool.checkout(self.key, lambda: self.fail('Not prewarmed'))
+        self.assertEquals(pool.drivers(), [driver])
+
+    def test_prewarm_respects_max_size(self):
+        pool = BrowserPool(max_size=2)
+        pool.checkout(self.key, FakeDriver)
+        threads = pool.prewarm(self.key, FakeDriver, count=4)
+        self.assertEquals(len(threads), 1)
+
+    def test_forced_quit_leaves_pool(self):
+        pool = BrowserPool()
+        driver = pool.checkout(self.key, FakeDriver)
+        driver.quit(force=True)
+        self.assertEquals(pool.drivers(), [])
+
+
+class OrderedSetTests(unittest.TestCase):
+    def test_ordering(self):
+        self.assertEquals(list(OrderedSet('abracadabra')), ['a', 'b', 'r', 'c', 'd'])
+
+    def test_indexing(self):
+        elems = OrderedSet('abcde')
+        self.assertEquals(elems[0], 'a')
+        self.assertEquals(elems[-1], 'e')
+        self.assertEquals(elems[1:3], ['b', 'c'])
+
+    def test_discard(self):
+        elems = OrderedSet('abcde')
+        elems.discard('b')
+        elems.discard('x')
+        self.assertEquals(list(elems), ['a', 'c', 'd', 'e'])
+        self.assertEquals(elems[1], 'c')
+        self.assertTrue('b' not in elems)
+
+    def test_set_operations(self):
+        elems = OrderedSet('abcde')
+        self.assertEquals(list(elems | 'fa'), ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEquals(list(elems & 'eca'), ['a', 'c', 'e'])
+        self.assertEquals(list(elems - 'bd'), ['a', 'c', 'e'])
+        self.assertEquals(list(elems), ['a', 'b', 'c', 'd', 'e'])
+
+    def test_in_place_operations(self):
+        elems = OrderedSet('abcde')
+        elems |= 'fa'
+        elems &= 'fedcb'
+        elems -= 'c'
+        self.assertEquals(list(elems), ['b', 'd', 'e', 'f'])
+        self.assertEquals(elems[2], 'e')
+
+    def test_pop(self):
+        elems = OrderedSet('abc')
+        self.assertEquals(elems.pop(), 'c')
+        self.assertEquals(elems.pop(last=False), 'a')
+        self.assertEquals(list(elems), ['b'])
+
+
+class FakeSelector(SelectorMixin):
+    _xpath_prefix = '//*'
+
+    def __init__(self):
+        self._selector_cache = LRUCache(maxsize=2)
+
+
+class SelectorCacheTests(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: None)
+        cache.get('c', lambda: 3)
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.get('a', lambda: None), 1)
+        self.assertEquals(cache.get('b', lambda: None), None)
+        self.assertEquals((cache.hits, cache.misses), (2, 4))
+
+    def test_selector_cache_hits(self):
+        selector = FakeSelector()
+        first = selector._get_selector(tag_name='li', text='1')
+        second = selector._get_selector(text='1', tag_name='li')
+        self.assertEquals(first, second)
+        self.assertEquals(selector._selector_cache.info()['hits'], 1)
+        self.assertEquals(selector._selector_cache.info()['misses'], 1)
+
+    def test_selector_cache_prefix(self):
+        selector = FakeSelector()
+        other = FakeSelector()
+        other._xpath_prefix = './/*'
+        other._selector_cache = selector._selector_cache
+        self.assertNotEquals(selector._get_selector(text='1'),
+                             other._get_selector(text='1'))
+
+    def test_unhashable_arguments(self):
+        selector = FakeSelector()
+        selector._get_selector(attribute_value=['href', '#'])
+        self.assertEquals(len(selector._selector_cache), 0)
+
+
+class ConversionTests(unittest.TestCase):
+    def setUp(self):
+        class ConversionDriver(webdriverplus.WebDriverMixin):
+            def __init__(self):
+                self._local_state = _LocalState()
+        self.driver = ConversionDriver()
+
+    def test_unwrap_plain_data(self):
+        data = [['a', 'b'], {'c': 1}]
+        self.assertTrue(self.driver._unwrap_value(data) is data)
+        self.assertEquals(data, [['a', 'b'], {'c': 1}])
+
+    def test_unwrap_elements(self):
+        ret = self.driver._unwrap_value(['a', {'ELEMENT': '1'},
+                                         [{'ELEMENT': '2'}, {'ELEMENT': '3'}]])
+        self.assertEquals(ret[0], 'a')
+        self.assertTrue(isinstance(ret[1], webdriverplus.WebElement))
+        self.assertTrue(isinstance(ret[2], WebElementSet))
+        self.assertEquals(len(ret[2]), 2)
+
+    def test_unwrap_raw(self):
+        self.driver._local_state.raw = True
+        ret = self.driver._unwrap_value([{'ELEMENT': '1'}])
+        self.assertEquals(ret, [{'ELEMENT': '1'}])
+
+    def test_wrap_without_elements(self):
+        params = {'script': 'return 1', 'args': [1, ['a']]}
+        self.assertTrue(self.driver._wrap_value(params) is params)
+
+    def test_wrap_elements(self):
+        elem = webdriverplus.WebElement(self.driver, '1')
+        params = {'script': 'return 1', 'args': ['a', elem]}
+        ret = self.driver._wrap_value(params)
+        self.assertEquals(ret['args'], ['a', {'ELEMENT': '1'}])
+        self.assertTrue(params['args'][1] is elem)
+
+
+class StubWebDriverHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Just enough of the WebDriver wire protocol to start a session,
+    get the title and quit.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, value, **extra):
+        self.server.clients.add(self.client_address)
+        body = dict(status=0, value=value, **extra)
+        body = json.dumps(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond({'browserName': 'stub'}, sessionId='stub')
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        self.respond('stub title')
+
+    def do_DELETE(self):
+        self.respond(None)
+
+
+class StubWebDriverServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           StubWebDriverHandler)
+        self.delay = delay
+        self.clients = set()  # (host, port) of each client connection
+        self.url = 'http://127.0.0.1:%d/wd/hub' % self.server_address[1]
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class TransportTests(unittest.TestCase):
+    def test_connection_reused(self):
+        server = StubWebDriverServer()
+        conn = PooledConnection(server.url, size=2)
+        for idx in range(5):
+            response = conn.execute(Command.GET_TITLE, {'sessionId': 'stub'})
+            self.assertEquals(response['value'], 'stub title')
+        self.assertEquals(len(server.clients), 1)
+        conn.close()
+        server.shutdown()
+
+    def test_pipeline(self):
+        server = StubWebDriverServer(delay=0.2)
+        conn = PooledConnection(server.url, size=4)
+        start = time.time()
+        responses = conn.pipeline([(Command.GET_TITLE, {'sessionId': 'stub'})] * 4)
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertEquals([response['value'] for response in responses],
+                          ['stub title'] * 4)
+        conn.close()
+        server.shutdown()
+
+    def test_remote_connection_pool(self):
+        server = StubWebDriverServer()
+        driver = webdriverplus.WebDriver('remote', command_executor=server.url,
+                                         desired_capabilities={},
+                                         connection_pool=2, quit_on_exit=False)
+        self.assertTrue(isinstance(driver.command_executor, PooledConnection))
+        self.assertEquals(driver.title, 'stub title')
+        self.assertEquals(driver.pipeline([(Command.GET_TITLE, {})] * 3),
+                          ['stub title'] * 3)
+        driver.quit()
+        server.shutdown()
+
+
+class ProfilerTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubWebDriverServer()
+        self.driver = webdriverplus.WebDriver('remote', command_executor=self.server.url,
+                                              desired_capabilities={},
+                                              quit_on_exit=False)
+
+    def tearDown(self):
+        self.driver.quit()
+        self.server.shutdown()
+
+    def test_profile(self):
+        with self.driver.profile() as profile:
+            self.driver.title
+            self.driver.title
+        self.assertEquals(profile.commands, 2)
+        record = profile.records[0]
+        self.assertEquals(record.name, Command.GET_TITLE)
+        self.assertEquals(record.caller, 'Remote.title')
+        self.assertTrue(record.location.startswith('runtests.py:'))
+        self.assertEquals(record.received, len('"stub title"'))
+        self.assertEquals(len(profile.by_caller()), 2)
+        self.assertTrue('Remote.title' in profile.report())
+
+    def test_profile_budget(self):
+        def over_budget():
+            with self.driver.profile(max_commands=1):
+                self.driver.title
+                self.driver.title
+        self.assertRaises(AssertionError, over_budget)
+        with self.driver.profile(max_commands=1) as profile:
+            self.driver.title
+        self.assertEquals(profile.commands, 1)
+
+
+class AsyncStubTests(unittest.TestCase):
+    def create_driver(self, server):
+        return webdriverplus.WebDriver('remote', command_executor=server.url,
+                                       desired_capabilities={},
+                                       quit_on_exit=False)
+
+    def test_async_property(self):
+        server = StubWebDriverServer()
+        driver = AsyncWebDriver(self.create_driver(server))
+        title = driver.title
+        self.assertEquals(title.result(), 'stub title')
+        self.assertTrue(title.done())
+        driver.quit().result()
+        server.shutdown()
+
+    def test_async_create(self):
+        server = StubWebDriverServer()
+        driver = AsyncWebDriver('remote', command_executor=server.url,
+                                desired_capabilities={}, quit_on_exit=False)
+        self.assertEquals(driver.title.result(), 'stub title')
+        self.assertEquals(driver.result().title, 'stub title')
+        driver.quit().result()
+        server.shutdown()
+
+    def test_async_sessions_concurrent(self):
+        server = StubWebDriverServer(delay=0.2)
+        executor = Executor(workers=4)
+        drivers = [AsyncWebDriver(self.create_driver(server), executor=executor)
+                   for idx in range(4)]
+        start = time.time()
+        titles = gather(*[driver.title for driver in drivers])
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertEquals(titles, ['stub title'] * 4)
+        gather(*[driver.quit() for driver in drivers])
+        server.shutdown()
+
+    def test_async_exception(self):
+        driver = AsyncWebDriver('unknown')
+        self.assertRaises(Exception, driver.result)
+        self.assertRaises(Exception, driver.title.result)
+
+
+class LxmlTests(unittest.TestCase):
+    def setUp(self):
+        self.driver = webdriverplus.WebDriver('lxml')
+        self.driver.open(u"""
+            <h1 id="title">Title</h1>
+            <ul>
+                <li class="first">one</li>
+                <li>two <b>bold</b></li>
+                <li style="display: none">hidden</li>
+            </ul>
+            <p>&#169; footer</p>
+        """)
+
+    def tearDown(self):
+        self.driver.quit()
+
+    def test_find(self):
+        self.assertEquals(len(self.driver.find('li')), 3)
+        self.assertEquals(self.driver.find(id='title').text, 'Title')
+        self.assertEquals(self.driver.find('ul').find('b').text, 'bold')
+        self.assertEquals(len(self.driver.find(tag_name='li', text_contains='o')), 2)
+
+    def test_traversal(self):
+        nodes = self.driver.find('li.first').next_all()
+        self.assertEquals(nodes.pluck('text'), ['two bold', ''])
+        self.assertEquals(self.driver.find('b').parent().index, 1)
+        self.assertEquals(self.driver.find('li').parent().tag_name, 'ul')
+
+    def test_text(self):
+        self.assertEquals(self.driver.find('p').text, u'\xa9 footer')
+        self.assertFalse(self.driver.find('li')[2].is_displayed)
+        self.assertEquals(self.driver.page_text, u'Title\none\ntwo bold\n\xa9 footer')
+
+    def test_html(self):
+        self.assertEquals(self.driver.find('b').parent().html, '<li>two <b>bold</b></li>')
+        self.assertEquals(self.driver.find('li.first').attributes, {'class': 'first'})
+
+    def test_count_and_query(self):
+        self.assertEquals(self.driver.count('li'), 3)
+        self.assertFalse(self.driver.exists('table'))
+        nodes = self.driver.query('ul').children().exclude('.first')
+        self.assertEquals(len(nodes), 2)
+        self.assertEquals(len(list(self.driver.find_iter('li', chunk_size=2))), 3)
+
+    def test_count_never_waits(self):
+        self.driver.wait = 5
+        start = time.time()
+        self.assertEquals(self.driver.count('table'), 0)
+        self.assertFalse(self.driver.find('ul').exists('table'))
+        self.assertTrue(time.time() - start < 1)
+        self.assertRaises(AssertionError, self.driver.count, bogus=1)
+        self.assertRaises(AssertionError, self.driver.find('ul').exists)
+
+    def test_stale_after_reload(self):
+        elem = self.driver.find('h1')
+        self.driver.open('<h1>Other</h1>')
+        self.assertRaises(StaleElementReferenceException, lambda: elem.text)
+
+    def test_javascript_not_supported(self):
+        self.assertRaises(WebDriverException, self.driver.execute_script, 'return 1;')
+
+    def test_reset(self):
+        self.driver.reset()
+        self.assertEquals(self.driver.current_url, 'about:blank')
+        self.assertEquals(len(self.driver.find('li')), 0)
+        # Finds don't change the page, so there is nothing to reset.
+        with self.driver.profile(max_commands=0):
+            self.driver.reset()
+
+    def test_wait_restores_script_timeout(self):
+        self.driver.set_script_timeout(3)
+        self.driver.wait = 1
+        self.assertEquals(len(self.driver.find('li')), 3)
+        self.assertEquals(self.driver._script_timeout, 3)
+
+    def test_wait_restores_default_script_timeout(self):
+        self.driver.wait = 1
+        self.assertEquals(len(self.driver.find('li')), 3)
+        self.assertEquals(self.driver._script_timeout, 30)
+
+    def test_wait_survives_navigation(self):
+        def navigated(*args):
+            raise WebDriverException('Detected a page unload event')
+        self.driver.execute_async_script = navigated
+        self.driver.wait = 1
+        self.assertEquals(len(self.driver.find('li')), 3)
+        self.assertRaises(TimeoutException, self.driver.find, 'table')
+
+    def test_open_modes(self):
+        for mode in ('file', 'server', 'write'):
+            self.driver.open(u'<h1>%s ☃</h1>' % mode, mode=mode)
+            self.assertEquals(self.driver.find('h1').text, u'%s ☃' % mode)
+
+    def test_open_server_remote(self):
+        self.driver.command_executor._url = 'http://grid:4444/wd/hub'
+        self.assertRaises(Exception, self.driver.open, '<h1>hi</h1>', mode='server')
+        self.driver.command_executor._url = 'http://localhost:4444/wd/hub'
+        self.driver.open('<h1>hi</h1>', mode='server')
+        self.assertEquals(self.driver.find('h1').text, 'hi')
+
+
+class PageServerTests(unittest.TestCase):
+    def test_page_replaced(self):
+        server = PageServer()
+        owner = object()
+        first = server.add(owner, 'first')
+        second = server.add(owner, 'second')
+        self.assertEquals(urllib2.urlopen(second).read(), 'second')
+        self.assertRaises(urllib2.HTTPError, urllib2.urlopen, first)
+        server.remove(owner)
+        self.assertEquals(server.pages, {})
+        server.shutdown()
+
 
 class DriverTests(WebDriverPlusTests):
     def test_open(self):
@@ -66,6 +583,36 @@ class DriverTests(WebDriverPlusTests):
         self.driver.open(page_text)
         self.assertEquals(self.driver.page_text,  page_text)
 
+    def test_reset(self):
+        self.driver.open('<p>hi</p>', mode='server')
+        self.driver.add_cookie({'name': 'flavour', 'value': 'oatmeal'})
+        self.driver.execute_script("localStorage.setItem('key', 'value');")
+        self.driver.execute_script("window.open('about:blank');")
+        self.driver.reset()
+        self.assertEquals(self.driver.current_url, 'about:blank')
+        self.assertEquals(len(self.driver.window_handles), 1)
+        self.driver.open('<p>hi</p>', mode='server')
+        self.assertEquals(self.driver.get_cookies(), [])
+        self.assertEquals(self.driver.execute_script("return localStorage.length;"), 0)
+
+    def test_reset_dismisses_alert(self):
+        self.driver.open('<p>hi</p>')
+        self.driver.execute_script("setTimeout(function () { alert('hi'); }, 0);")
+        time.sleep(0.5)
+        self.driver.reset()
+        self.assertEquals(self.driver.alert, None)
+        self.assertEquals(self.driver.current_url, 'about:blank')
+
+    def test_open_modes(self):
+        for mode in ('server', 'write'):
+            self.driver.open(u'<h1>%s ☃</h1>' % mode, mode=mode)
+            self.assertEquals(self.driver.find('h1').text, u'%s ☃' % mode)
+
+    def test_open_write_fresh_page(self):
+        self.driver.open('<script>var leaked = 1;</script>', mode='write')
+        self.driver.open('<p>hi</p>', mode='write')
+        self.assertEquals(self.driver.execute_script("return typeof leaked;"), 'undefined')
+
     def test_find(self):
         self.driver.open(u'<h1>123</h1><h2>☃</h2><h3>789</h3>')
         self.assertEquals(self.driver.find('h2').text, u'☃')
@@ -74,6 +621,15 @@ class DriverTests(WebDriverPlusTests):
         self.driver.open('<h1>123</h1><h2>456</h2><h3>789</h3>')
         self.assertEquals(self.driver.find('h2').text, '456')
 
+    def test_execute_script_raw(self):
+        self.driver.open('<h1>123</h1>')
+        script = 'return [document.body.innerHTML, document.body.firstChild]'
+        ret = self.driver.execute_script(script)
+        self.assertTrue(isinstance(ret[1], webdriverplus.WebElement))
+        ret = self.driver.execute_script(script, raw=True)
+        self.assertEquals(ret[0], '<h1>123</h1>')
+        self.assertTrue(isinstance(ret[1], dict))
+
 
 class SelectorTests(WebDriverPlusTests):
     def setUp(self):
@@ -124,6 +680,15 @@ class SelectorTests(WebDriverPlusTests):
         nodes = self.driver.find(tag_name='li', text='fubar')
         self.assertFalse(nodes)
 
+    def test_multiple_combined_selectors(self):
+        nodes = self.driver.find(tag_name='input', type='checkbox', checked=True)
+        self.assertEquals(len(nodes), 1)
+        self.assertEquals(nodes.value, 'blue')
+
+    def test_multiple_complex_selectors(self):
+        node = self.driver.find('ul > li', text='two')
+        self.assertEquals(node.html, '<li>two</li>')
+
     def test_id(self):
         node = self.driver.find(id='mylist')
         self.assertEquals(node.tag_name, 'ul')
@@ -213,6 +778,26 @@ class SelectorTests(WebDriverPlusTests):
     # TODO: checked=True, checked=False, selected=True, selected=False
 
 
+class AsyncTests(WebDriverPlusTests):
+    def setUp(self):
+        super(AsyncTests, self).setUp()
+        snippet = """<ul>
+                         <li>1</li>
+                         <li class="selected">2</li>
+                         <li>3</li>
+                     </ul>"""
+        self.driver.open(snippet)
+
+    def test_async_traversal(self):
+        driver = AsyncWebDriver(self.driver)
+        nodes = driver.find('ul').children().exclude('.selected')
+        self.assertEquals(nodes.pluck('text').result(), ['1', '3'])
+
+    def test_async_indexing(self):
+        driver = AsyncWebDriver(self.driver)
+        self.assertEquals(driver.find('li')[1].text.result(), '2')
+
+
 class TraversalTests(WebDriverPlusTests):
     def setUp(self):
         super(TraversalTests, self).setUp()
@@ -309,6 +894,14 @@ class FilteringTests(WebDriverPlusTests):
         nodes = self.driver.find('li').exclude('.selected')
         self.assertEquals([node.text for node in nodes], ['1', '2', '4'])
 
+    def test_filter_keyword(self):
+        nodes = self.driver.find('li').filter(text='4')
+        self.assertEquals([node.text for node in nodes], ['4'])
+
+    def test_exclude_multiple(self):
+        nodes = self.driver.find('li').exclude('.selected', text='5')
+        self.assertEquals([node.text for node in nodes], ['1', '2', '3', '4'])
+
 
 class ShortcutTests(WebDriverPlusTests):
     def setUp(self):
@@ -371,6 +964,26 @@ class InspectionTests(WebDriverPlusTests):
         elem.style.color = 'green'
         self.assertTrue(elem.style.color in ('#008000', 'green', 'rgb(0, 128, 0)', 'rgba(0, 128, 0, 1)'))
 
+    def test_set_css_property(self):
+        colors = self.driver.find('li').value_of_css_property('color')
+        self.assertEquals(len(colors), 5)
+        self.assertTrue(colors[2] in ('red', 'rgb(255, 0, 0)', 'rgba(255, 0, 0, 1)'))
+        self.assertEquals(colors[0], colors[1])
+        self.assertEquals(self.driver.find('li').value_of_css_property('backgroundColor'),
+                          [elem.value_of_css_property('backgroundColor')
+                           for elem in self.driver.find('li')])
+
+    def test_set_javascript(self):
+        self.assertEquals(self.driver.find('li').javascript('innerHTML'),
+                          ['1', '2', '3', '4', '5'])
+        self.assertEquals(self.driver.find('li').javascript('innerHTML;'),
+                          ['1', '2', '3', '4', '5'])
+
+    def test_set_javascript_elements(self):
+        parents = self.driver.find('li').javascript('parentNode')
+        self.assertEquals(len(parents), 5)
+        self.assertEquals(parents, [self.driver.find('ul')._first] * 5)
+
     def test_size(self):
         elem = self.driver.find('img')
         self.assertEquals(elem.size.width, 100)
@@ -390,6 +1003,21 @@ class InspectionTests(WebDriverPlusTests):
         self.assertEquals(set(elem.attributes.values()),
                           set(['100px', '50px', '#']))
 
+    def test_pluck(self):
+        elems = self.driver.find('li')
+        self.assertEquals(elems.pluck('text'), ['1', '2', '3', '4', '5'])
+        records = elems[1:3].pluck('text', 'class', 'index')
+        self.assertEquals(records, [
+            {'text': '2', 'class': None, 'index': 1},
+            {'text': '3', 'class': 'selected', 'index': 2},
+        ])
+
+    def test_pluck_geometry(self):
+        (record,) = self.driver.find('img').pluck('size', 'location', 'rect')
+        self.assertEquals(record['size'], (100, 50))
+        self.assertEquals(record['rect'][2:], (100, 50))
+        self.assertEquals(record['rect'][:2], record['location'])
+
     def test_get_attribute(self):
         elem = self.driver.find('img')
         self.assertEquals(elem.attributes['width'], '100px')
@@ -440,6 +1068,57 @@ class FormInspectionTests(WebDriverPlusTests):
         self.assertEquals(elem.find(value='jam').is_checked, True)
 
 
+class SnapshotTests(WebDriverPlusTests):
+    extra_webdriver_kwargs = {'snapshot': True}
+
+    def setUp(self):
+        super(SnapshotTests, self).setUp()
+        snippet = """<ul>
+                         <li>1</li>
+                         <li class="selected">2</li>
+                         <li>3</li>
+                     </ul>
+                     <input type="text" name="username" value="mike">"""
+        self.driver.open(snippet)
+
+    def test_snapshot_values(self):
+        elem = self.driver.find('.selected')
+        self.assertEquals(elem.index, 1)
+        self.assertEquals(elem.html, '<li class="selected">2</li>')
+        self.assertEquals(elem.inner_html, '2')
+
+    def test_snapshot_html_fetched_when_read(self):
+        elem = self.driver.find('ul')._first
+        self.assertEquals(elem.index, 0)
+        self.assertFalse('html' in self.driver._snapshot_cache[elem._id])
+        self.assertTrue(elem.html.startswith('<ul>'))
+        self.assertTrue('html' in self.driver._snapshot_cache[elem._id])
+        self.assertFalse('inner_html' in self.driver._snapshot_cache[elem._id])
+
+    def test_snapshot_page_changed(self):
+        elem = self.driver.find('.selected')._first
+        script = """setTimeout(function () {
+                        arguments[0].innerHTML = 'changed';
+                    }.bind(null, arguments[0]), 300);"""
+        self.driver.execute_script(script, elem)
+        self.assertEquals(elem.inner_html, '2')
+        time.sleep(0.5)
+        self.assertEquals(elem.inner_html, 'changed')
+
+    def test_snapshot_send_keys(self):
+        elem = self.driver.find('input')
+        self.assertEquals(elem.value, 'mike')
+        elem.send_keys('y')
+        self.assertEquals(elem.value, 'mikey')
+
+    def test_snapshot_value_set_by_page(self):
+        elem = self.driver.find('input')
+        self.assertEquals(elem.value, 'mike')
+        # Setting a property isn't a mutation, so value is never cached.
+        self.driver.execute_script("arguments[0].value = 'lucy';", elem._first)
+        self.assertEquals(elem.value, 'lucy')
+
+
 class ValueTests(WebDriverPlusTests):
     def setUp(self):
         super(ValueTests, self).setUp()
@@ -467,6 +1146,12 @@ class InputTests(WebDriverPlusTests):
         elem = self.driver.find('input')
         elem.send_keys("hello")
 
+    def test_set_send_keys(self):
+        self.driver.open("""<input type="text" value="a">
+                            <input type="text" value="b">""")
+        self.driver.find('input').send_keys('c')
+        self.assertEquals(self.driver.find('input').pluck('value'), ['ac', 'bc'])
+
 
 class SetTests(WebDriverPlusTests):
     def setUp(self):
@@ -490,6 +1175,100 @@ class SetTests(WebDriverPlusTests):
         self.assertEquals(len(nodes), 8)
         self.assertEquals(len(nodes.parent()), 2)
 
+    def test_set_find_link_text(self):
+        self.driver.open('<ul><li><a href="#">x</a></li></ul>'
+                         '<ul><li><a href="#">y</a></li><li><a href="#">x</a></li></ul>')
+        nodes = self.driver.find('ul').find(link_text='x')
+        self.assertEquals(len(nodes), 2)
+        self.assertEquals(nodes.parent().pluck('index'), [0, 1])
+
+    def test_set_traversal_document_order(self):
+        nodes = self.driver.find('ul').children()
+        text = [node.text for node in nodes]
+        self.assertEquals(text, ['1', '2', '3', '4', '5', 'a', 'b', 'c'])
+
+    def test_set_find(self):
+        nodes = self.driver.find('ul').find('li', text='b')
+        self.assertEquals([node.text for node in nodes], ['b'])
+        nodes = self.driver.find('li').parent().find('li')
+        self.assertEquals(len(nodes), 8)
+
+    def test_set_find_invalid(self):
+        nodes = self.driver.find('ul')
+        self.assertRaises(AssertionError, nodes.find, bogus=1)
+        self.assertRaises(AssertionError, nodes.find)
+
+    def test_count_exists(self):
+        self.assertEquals(self.driver.count('li'), 8)
+        self.assertEquals(self.driver.find('ul')[1].count('li'), 3)
+        self.assertEquals(self.driver.find('ul').count('li', text='b'), 1)
+        self.assertTrue(self.driver.exists('li', text='5'))
+        self.assertFalse(self.driver.find('li').exists('li'))
+
+    def test_index(self):
+        self.assertEquals([node.index for node in self.driver.find('li')],
+                          [0, 1, 2, 3, 4, 0, 1, 2])
+
+    def test_find_iter(self):
+        nodes = self.driver.find_iter('li', chunk_size=3)
+        self.assertEquals([node.text for node in nodes],
+                          ['1', '2', '3', '4', '5', 'a', 'b', 'c'])
+        nodes = self.driver.find('ul')[1].find_iter('li', chunk_size=2)
+        self.assertEquals([node.text for node in nodes], ['a', 'b', 'c'])
+
+    def test_find_iter_invalid(self):
+        self.assertRaises(AssertionError, self.driver.find_iter, bogus=1)
+        self.assertRaises(AssertionError, self.driver.find('ul').find_iter)
+
+    def test_find_iter_stopped_early(self):
+        nodes = self.driver.find('ul').find_iter('li', chunk_size=2)
+        self.assertEquals(nodes.next().text, '1')
+        nodes.close()
+        results = self.driver.execute_script('return window.__webdriverplus_results')
+        self.assertEquals(results, {})
+
+    def test_set_sort(self):
+        nodes = self.driver.find('li')
+        reordered = (nodes[4:] | nodes[:4]).sort()
+        self.assertEquals(list(reordered), list(nodes))
+
+    def test_set_traversal_uniqueness(self):
+        nodes = self.driver.find('li').siblings()
+        self.assertEquals(len(nodes), 8)
+        self.assertEquals(len(nodes.ancestors()), 4)
+
+
+class QueryTests(WebDriverPlusTests):
+    def setUp(self):
+        super(QueryTests, self).setUp()
+        snippet = """<ul>
+                         <li>1</li>
+                         <li class="selected">2</li>
+                         <li>3</li>
+                     </ul>
+                     <ul>
+                         <li><a href="#">a</a></li>
+                         <li>b</li>
+                     </ul>"""
+        self.driver.open(snippet)
+
+    def test_query_chain(self):
+        nodes = self.driver.query('ul').children().exclude('.selected')
+        self.assertEquals([node.text for node in nodes], ['1', '3', 'a', 'b'])
+
+    def test_query_matches_eager(self):
+        lazy = self.driver.query('li.selected').siblings().parent().next()
+        eager = self.driver.find('li.selected').siblings().parent().next()
+        self.assertEquals(list(lazy), list(eager))
+
+    def test_query_uncompiled_step(self):
+        nodes = self.driver.query('ul').find(link_text='a').parent()
+        self.assertEquals([node.text for node in nodes], ['a'])
+
+    def test_query_from_element(self):
+        elem = self.driver.find('ul')[0]
+        self.assertEquals(len(elem.query('li').filter(text='2')), 1)
+
 
 class ActionTests(WebDriverPlusTests):
     # TODO: Urg.  Refactor these
@@ -505,6 +1284,49 @@ class ActionTests(WebDriverPlusTests):
         self.driver.open(snippet).find('a').double_click()
         self.assertEquals(self.driver.find(id='msg').text, 'double click')
 
+    def test_helpers_reinstalled_after_navigation(self):
+        js = "document.getElementById('msg').innerHTML += 'x'"
+        snippet = "<div id='msg'></div><a onDblclick=\"%s\">here</a>" % js
+        for idx in range(2):
+            elem = self.driver.open(snippet).find('a')
+            elem.double_click()
+            elem.double_click()
+            self.assertEquals(self.driver.find(id='msg').text, 'xx')
+            version = self.driver.execute_script('return window.__wdp.version')
+            self.assertEquals(version, _HELPERS_VERSION)
+
+    def test_helpers_installed_with_call(self):
+        snippet = "<a onDblclick=\"this.innerHTML = 'x'\">here</a>"
+        elem = self.driver.open(snippet).find('a')
+        # The call finds no helpers, so installs them and calls again at once.
+        with self.driver.profile(max_commands=2):
+            elem.double_click()
+        with self.driver.profile(max_commands=1):
+            elem.double_click()
+
+    def test_dispatch(self):
+        js = "document.getElementById('msg').innerHTML += this.innerHTML"
+        snippet = """<div id='msg'></div>
+                     <a onMouseOver="%s">a</a><a onMouseOver="%s">b</a>""" % (js, js)
+        self.driver.open(snippet).find('a').dispatch('mouseover')
+        self.assertEquals(self.driver.find(id='msg').text, 'ab')
+
+    def test_dispatch_error(self):
+        self.driver.open("<a>a</a><a>b</a>")
+        try:
+            self.driver.find('a').dispatch('keypress')
+        except webdriverplus.DispatchError, e:
+            self.assertEquals(len(e.errors), 2)
+        else:
+            self.fail('DispatchError not raised')
+
+    def test_each_double_click(self):
+        js = "document.getElementById('msg').innerHTML += this.innerHTML"
+        snippet = """<div id='msg'></div>
+                     <a onDblclick="%s">a</a><a onDblclick="%s">b</a>""" % (js, js)
+        self.driver.open(snippet).find('a').each.double_click()
+        self.assertEquals(self.driver.find(id='msg').text, 'ab')
+
     def test_context_click(self):
         js = "document.getElementById('msg').innerHTML = event.button"
         snippet = "<div id='msg'></div><a onclick=\"%s\">here</a>" % js
@@ -596,6 +1418,23 @@ class WaitTests(WebDriverPlusTests):
         self.assertEquals(len(nodes), 1)
 
 
+class ShortWaitTests(WebDriverPlusTests):
+    extra_webdriver_kwargs = {'wait': 1}
+
+    def setUp(self):
+        super(ShortWaitTests, self).setUp()
+        snippet = WAIT_SNIPPET
+        self.driver.open(snippet)
+
+    def test_element_added_after_load_found(self):
+        nodes = self.driver.find('#mypara', text_contains='Hello World')
+        self.assertEquals(len(nodes), 1)
+
+    def test_element_never_added_times_out(self):
+        self.assertRaises(TimeoutException, self.driver.find, 'p',
+                          text_contains='Goodbye')
+
+
 class NoWaitTests(WebDriverPlusTests):
     def setUp(self):
         super(NoWaitTests, self).setUp()
@@ -5,9 +5,15 @@ from selenium.webdriver.ie.webdriver import WebDriver as _Ie
 from selenium.webdriver.remote.webdriver import WebDriver as _Remote
 from selenium.webdriver.phantomjs.webdriver import WebDriver as _PhantomJS
 
+from webdriverplus.asynchronous import AsyncWebDriver, AsyncWebElementSet, gather
+from webdriverplus.lxmldriver import LxmlConnection
+from webdriverplus.pool import BrowserPool
+from webdriverplus.selectors import selector_cache
+from webdriverplus.transport import PooledConnection
 from webdriverplus.utils import _download
 from webdriverplus.webdriver import WebDriverMixin
 from webdriverplus.webelement import WebElement
+from webdriverplus.webelementset import DispatchError
 
 import atexit
 import os
@@ -24,7 +30,7 @@ def get_version():
 
 
 class WebDriver(WebDriverMixin):
-    _pool = {}  # name -> (instance, signature)
+    _pool = BrowserPool()
     _quit_on_exit = set()  # set of instances
     _selenium_server = None  # Popen object
     _default_browser = 'firefox'
@@ -44,41 +50,72 @@ class WebDriver(WebDriverMixin):
                 pass
 
     @classmethod
-    def _get_from_pool(cls, browser):
-        """Returns (instance, (args, kwargs))"""
-        return cls._pool.get(browser, (None, (None, None)))
+    def configure_pool(cls, max_size=None, idle_timeout=None, timeout=None):
+        """
+        Configures the pool used for `reuse_browser` instances.
 
-    def __new__(cls, browser=None, *args, **kwargs):
-        browser = browser or cls._default_browser
-        quit_on_exit = kwargs.get('quit_on_exit', True)
-        reuse_browser = kwargs.get('reuse_browser')
-        signature = (args, kwargs)
-        browser = browser.lower()
+        max_size:     The maximum number of instances for each browser and
+                      set of arguments.
+        idle_timeout: Quit instances that have been idle for this many seconds.
+        timeout:      How long to wait for an instance when the pool is full.
+        """
+        cls._pool.max_size = max_size
+        cls._pool.idle_timeout = idle_timeout
+        cls._pool.timeout = timeout
+
+    @classmethod
+    def prewarm(cls, browser=None, count=1, *args, **kwargs):
+        """
+        Starts `count` browser instances in background threads, and adds
+        them to the pool, ready to be used by `WebDriver(browser, ...,
+        reuse_browser=True)` with the same arguments.
+
+        Returns the list of threads, which may be joined to wait for the
+        instances to finish starting.
+        """
+        browser = (browser or cls._default_browser).lower()
+        kwargs['reuse_browser'] = True
+        key = (browser, args, kwargs)
 
-        pooled_browser, pooled_signature = WebDriver._get_from_pool(browser)
+        def create():
+            driver = cls._create(browser, *args, **kwargs)
+            if kwargs.get('quit_on_exit', True):
+                WebDriver._quit_on_exit.add(driver)
+            return driver
 
-        reused_pooled_browser = False
+        return WebDriver._pool.prewarm(key, create, count)
 
-        if pooled_signature == signature:
-            driver = pooled_browser
-            reused_pooled_browser = True
-        elif browser == 'firefox':
-            driver = Firefox(*args, **kwargs)
+    @classmethod
+    def _create(cls, browser, *args, **kwargs):
+        if browser == 'firefox':
+            return Firefox(*args, **kwargs)
         elif browser == 'chrome':
-            driver = Chrome(*args, **kwargs)
+            return Chrome(*args, **kwargs)
         elif browser == 'ie':
-            driver = Ie(*args, **kwargs)
+            return Ie(*args, **kwargs)
         elif browser == 'remote':
-            driver = Remote(*args, **kwargs)
+            return Remote(*args, **kwargs)
         elif browser == 'phantomjs':
-            driver = PhantomJS(*args, **kwargs)
+            return PhantomJS(*args, **kwargs)
         elif browser == 'htmlunit':
-            driver = HtmlUnit(*args, **kwargs)
+            return HtmlUnit(*args, **kwargs)
+        elif browser == 'lxml':
+            return Lxml(*args, **kwargs)
+        raise Exception("Unknown browser '%s'" % browser)
 
-        if reuse_browser and not reused_pooled_browser:
-            if pooled_browser:
-                pooled_browser.quit(force=True)
-            WebDriver._pool[browser] = (driver, signature)
+    def __new__(cls, browser=None, *args, **kwargs):
+        browser = browser or cls._default_browser
+        quit_on_exit = kwargs.get('quit_on_exit', True)
+        reuse_browser = kwargs.get('reuse_browser')
+        browser = browser.lower()
+
+        if reuse_browser:
+            key = (browser, args, kwargs)
+            driver = WebDriver._pool.checkout(
+                key, lambda: cls._create(browser, *args, **kwargs)
+            )
+        else:
+            driver = cls._create(browser, *args, **kwargs)
 
         if quit_on_exit:
             WebDriver._quit_on_exit.add(driver)
@@ -105,13 +142,29 @@ class Ie(WebDriverMixin, _Ie):
 
 
 class Remote(WebDriverMixin, _Remote):
-    pass
+    def __init__(self, command_executor='http://127.0.0.1:4444/wd/hub',
+                 *args, **kwargs):
+        pool_size = kwargs.pop('connection_pool', None)
+        if pool_size and isinstance(command_executor, basestring):
+            command_executor = PooledConnection(command_executor, pool_size)
+        super(Remote, self).__init__(command_executor, *args, **kwargs)
 
 
 class PhantomJS(WebDriverMixin, _PhantomJS):
     pass
 
 
+class Lxml(WebDriverMixin, _Remote):
+    """
+    An in-process browser for static HTML, which runs finds, traversals
+    and filters against an lxml document.  No browser process is needed,
+    but there is no JavaScript or layout.
+    """
+    def __init__(self, **kwargs):
+        super(Lxml, self).__init__(LxmlConnection(), {'browserName': 'lxml'},
+                                   **kwargs)
+
+
 class HtmlUnit(WebDriverMixin, _Remote):
     _selenium = 'selenium-server-standalone-2.22.0.jar'
     _selenium_url = 'http://selenium.googlecode.com/files/' + _selenium
@@ -120,7 +173,11 @@ class HtmlUnit(WebDriverMixin, _Remote):
     def __init__(self, *args, **kwargs):
         self._perform_auto_install()
         self._autorun_selenium_server()
-        super(HtmlUnit, self).__init__("http://localhost:4444/wd/hub",
+        command_executor = "http://localhost:4444/wd/hub"
+        pool_size = kwargs.pop('connection_pool', None)
+        if pool_size:
+            command_executor = PooledConnection(command_executor, pool_size)
+        super(HtmlUnit, self).__init__(command_executor,
                                        DesiredCapabilities.HTMLUNIT, **kwargs)
 
     def _create_web_element(self, element_id):
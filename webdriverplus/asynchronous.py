@@ -0,0 +1,253 @@
+from selenium.webdriver.remote.webdriver import WebDriver as _RemoteWebDriver
+
+from webdriverplus.webdriver import WebDriverMixin
+from webdriverplus.webelement import WebElement
+from webdriverplus.webelementset import WebElementSet
+
+import Queue
+import sys
+import threading
+
+
+# Methods that return a set of elements.
+_SET_METHODS = frozenset([
+    'find', 'query', 'filter', 'exclude', 'sort', 'parent', 'children',
+    'descendants', 'ancestors', 'next', 'prev', 'next_all', 'prev_all',
+    'siblings',
+])
+
+
+class Future(object):
+    """
+    The result of a call that is running in the background.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._value = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.isSet()
+
+    def _wait(self, timeout):
+        self._event.wait(timeout)
+        if not self._event.isSet():
+            raise Exception('Timed out waiting for a result.')
+
+    def result(self, timeout=None):
+        """
+        Waits for the call to finish and returns its value,
+        or re-raises the exception that it raised.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._exc_info and self._exc_info[1]
+
+    def add_done_callback(self, func):
+        """
+        Calls func(future) when the call finishes, or straight away
+        if it already has.
+        """
+        self._lock.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        finally:
+            self._lock.release()
+        func(self)
+
+    def _finish(self, value=None, exc_info=None):
+        self._lock.acquire()
+        try:
+            self._value = value
+            self._exc_info = exc_info
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for func in callbacks:
+            func(self)
+
+    def _run(self, func):
+        try:
+            value = func()
+        except Exception:
+            self._finish(exc_info=sys.exc_info())
+        else:
+            self._finish(value)
+
+
+class Executor(object):
+    """
+    A fixed size pool of worker threads, shared by any number of sessions.
+    Threads are started as they are needed.
+    """
+    def __init__(self, workers=8):
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func):
+        self._lock.acquire()
+        try:
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+        self._queue.put(func)
+
+    def _work(self):
+        while True:
+            func = self._queue.get()
+            func()
+
+
+_default_executor = None
+
+
+def _get_default_executor():
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = Executor()
+    return _default_executor
+
+
+class _Session(object):
+    """
+    Runs calls for one browser instance one at a time, in the order they
+    were made, without tying up a worker thread while there is nothing to do.
+    """
+    def __init__(self, executor):
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._calls = []  # List of (future, func)
+        self._running = False
+
+    def run(self, future, func):
+        self._lock.acquire()
+        try:
+            self._calls.append((future, func))
+            if self._running:
+                return
+            self._running = True
+        finally:
+            self._lock.release()
+        self._executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            self._lock.acquire()
+            try:
+                if not self._calls:
+                    self._running = False
+                    return
+                future, func = self._calls.pop(0)
+            finally:
+                self._lock.release()
+            future._run(func)
+
+
+class _AsyncProxy(Future):
+    """
+    A future for a driver, element or set of elements.
+
+    Methods and properties of the underlying object may be used before it
+    is ready; they return futures in turn, and are run in order once the
+    underlying object is available.
+    """
+    _classes = ()  # Used to tell properties from methods.
+
+    def __init__(self, session):
+        super(_AsyncProxy, self).__init__()
+        self._session = session
+
+    def _then(self, cls, func):
+        if issubclass(cls, _AsyncProxy):
+            ret = cls(self._session)
+        else:
+            ret = cls()
+        self._session.run(ret, lambda: func(self.result()))
+        return ret
+
+    def _is_method(self, name):
+        if name in _SET_METHODS:
+            return True
+        for cls in self._classes:
+            attr = getattr(cls, name, None)
+            if attr is not None:
+                return callable(attr) and not isinstance(attr, property)
+        return False
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        cls = AsyncWebElementSet if name in _SET_METHODS else Future
+
+        if not self._is_method(name):
+            return self._then(cls, lambda target: getattr(target, name))
+
+        def method(*args, **kwargs):
+            return self._then(cls, lambda target: getattr(target, name)(*args, **kwargs))
+        method.__name__ = name
+        return method
+
+    def __getitem__(self, key):
+        cls = AsyncWebElementSet if isinstance(key, slice) else AsyncWebElement
+        return self._then(cls, lambda target: target[key])
+
+    def __repr__(self):
+        state = self.done() and 'done' or 'pending'
+        return '<%s %s>' % (self.__class__.__name__, state)
+
+
+class AsyncWebDriver(_AsyncProxy):
+    """
+    A WebDriver whose methods and properties return futures.
+
+    Calls for each instance are run in order, on a pool of worker threads
+    shared between instances, so many browsers can be driven at once
+    without a thread for each.
+
+        >>> drivers = [AsyncWebDriver('firefox') for idx in range(10)]
+        >>> [driver.get(url) for driver, url in zip(drivers, urls)]
+        >>> titles = gather(*[driver.title for driver in drivers])
+
+    `browser` may also be an existing WebDriver instance.
+    """
+    _classes = (WebDriverMixin, _RemoteWebDriver)
+
+    def __init__(self, browser=None, *args, **kwargs):
+        executor = kwargs.pop('executor', None) or _get_default_executor()
+        super(AsyncWebDriver, self).__init__(_Session(executor))
+        if isinstance(browser, WebDriverMixin):
+            self._finish(browser)
+        else:
+            from webdriverplus import WebDriver
+            self._session.run(self, lambda: WebDriver(browser, *args, **kwargs))
+
+
+class AsyncWebElementSet(_AsyncProxy):
+    _classes = (WebElementSet,)
+
+
+class AsyncWebElement(_AsyncProxy):
+    _classes = (WebElement,)
+
+
+def gather(*futures):
+    """
+    Waits for all of the futures, and returns a list of their results.
+    """
+    return [future.result() for future in futures]
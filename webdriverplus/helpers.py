@@ -0,0 +1,145 @@
+import hashlib
+
+
+# http://stackoverflow.com/questions/6157929/how-to-simulate-mouse-click-using-javascript/6158050#6158050
+_SIMULATE_JS = """function (element, eventName, options) {
+    function extend(destination, source) {
+        for (var property in source)
+          destination[property] = source[property];
+        return destination;
+    }
+
+    var eventMatchers = {
+        'HTMLEvents': /^(?:load|unload|abort|error|select|change|submit|reset|focus|blur|resize|scroll)$/,
+        'MouseEvents': /^(?:click|dblclick|mouse(?:down|up|over|move|out))$/
+    }
+    var defaultOptions = {
+        pointerX: 0,
+        pointerY: 0,
+        button: 0,
+        ctrlKey: false,
+        altKey: false,
+        shiftKey: false,
+        metaKey: false,
+        bubbles: true,
+        cancelable: true
+    }
+
+    options = extend(extend({}, defaultOptions), options || {});
+    var oEvent, eventType = null;
+
+    for (var name in eventMatchers)
+    {
+        if (eventMatchers[name].test(eventName)) { eventType = name; break; }
+    }
+
+    if (!eventType)
+        throw new SyntaxError('Only HTMLEvents and MouseEvents interfaces are supported');
+
+    if (document.createEvent)
+    {
+        oEvent = document.createEvent(eventType);
+        if (eventType == 'HTMLEvents')
+        {
+            oEvent.initEvent(eventName, options.bubbles, options.cancelable);
+        }
+        else
+        {
+            oEvent.initMouseEvent(eventName, options.bubbles, options.cancelable, document.defaultView,
+      options.button, options.pointerX, options.pointerY, options.pointerX, options.pointerY,
+      options.ctrlKey, options.altKey, options.shiftKey, options.metaKey, options.button, element);
+        }
+        element.dispatchEvent(oEvent);
+    }
+    else
+    {
+        options.clientX = options.pointerX;
+        options.clientY = options.pointerY;
+        var evt = document.createEventObject();
+        oEvent = extend(evt, options);
+        element.fireEvent('on' + eventName, oEvent);
+    }
+}"""
+
+_HIGHLIGHT_JS = """function (elems) {
+    for (var i = 0; i < elems.length; i++) {
+        var elem = elems[i];
+        elem.setAttribute('savedBackground', elem.style.backgroundColor);
+        elem.setAttribute('savedBorder', elem.style.borderColor);
+        elem.setAttribute('savedOutline', elem.style.outline);
+        elem.style.backgroundColor = '#f9edbe';
+        elem.style.borderColor = '#f9edbe';
+        elem.style.outline = '1px solid black';
+    }
+}"""
+
+_UNHIGHLIGHT_JS = """function (elems) {
+    for (var i = 0; i < elems.length; i++) {
+        var elem = elems[i];
+        elem.style.backgroundColor = elem.getAttribute('savedBackground');
+        elem.style.borderColor = elem.getAttribute('savedBorder');
+        elem.style.outline = elem.getAttribute('savedOutline');
+    }
+}"""
+
+# Simulates an event on each element, returning a list with null for each
+# element that succeeded, or the error message for each that failed.
+_DISPATCH_JS = """function (elems, eventName, options) {
+    var ret = [];
+    for (var i = 0; i < elems.length; i++) {
+        try {
+            this.simulate(elems[i], eventName, options);
+            ret.push(null);
+        } catch (e) {
+            ret.push(String(e && e.message || e));
+        }
+    }
+    return ret;
+}"""
+
+# http://stackoverflow.com/questions/2048720/get-all-attributes-from-a-html-element-with-javascript-jquery
+_ATTRIBUTES_JS = """function (elem) {
+    var ret = {};
+    for (var i = 0, attrs = elem.attributes, l = attrs.length; i < l; i++) {
+        ret[attrs.item(i).nodeName] = attrs.item(i).nodeValue;
+    }
+    return ret;
+}"""
+
+# Helper functions, which are installed once per page on `window.__wdp`,
+# so that actions only need to send a short call script.
+_HELPERS = {
+    'simulate': _SIMULATE_JS,
+    'dispatch': _DISPATCH_JS,
+    'highlight': _HIGHLIGHT_JS,
+    'unhighlight': _UNHIGHLIGHT_JS,
+    'attributes': _ATTRIBUTES_JS,
+}
+
+# Changes whenever the helpers do, so that a page with helpers installed
+# by a different version gets the current ones.
+_HELPERS_VERSION = hashlib.md5(repr(sorted(_HELPERS.items()))).hexdigest()[:8]
+
+# Returned by a call script when the helpers aren't installed in the
+# current page, eg. after navigating to a new page.
+_HELPERS_MISSING = '__wdp_missing__'
+
+_INSTALL_SCRIPT = 'window.__wdp = {version: "%s", %s};' % (
+    _HELPERS_VERSION,
+    ', '.join(['%s: %s' % (name, body) for name, body in sorted(_HELPERS.items())])
+)
+
+_CALL_SCRIPTS = dict([(name, """
+    var wdp = window.__wdp;
+    if (!wdp || wdp.version !== "%s") {
+        return "%s";
+    }
+    return wdp.%s.apply(wdp, arguments);
+""" % (_HELPERS_VERSION, _HELPERS_MISSING, name)) for name in _HELPERS])
+
+# Sent in place of a call script that returned _HELPERS_MISSING, so that
+# a page without the helpers costs one extra command rather than two.
+_INSTALL_AND_CALL_SCRIPTS = dict([(name, """
+    %s
+    return window.__wdp.%s.apply(window.__wdp, arguments);
+""" % (_INSTALL_SCRIPT, name)) for name in _HELPERS])
@@ -0,0 +1,589 @@
+"""
+An in-process browser for static HTML, backed by lxml.
+
+LxmlConnection stands in for a RemoteConnection, and answers WebDriver
+commands from an lxml document rather than sending them to a browser.
+webdriverplus' own batched scripts (find, traversal, filtering etc...) are
+evaluated natively, with XPath and CSS run by lxml, so the whole selector
+and traversal API works.  There is no rendering, and no JavaScript, so
+anything that needs either raises a WebDriverException.
+"""
+from selenium.webdriver.remote.errorhandler import ErrorCode
+
+from webdriverplus.helpers import _CALL_SCRIPTS
+from webdriverplus.query import _CHAIN_SCRIPT
+from webdriverplus.selectors import LRUCache, xpath_literal
+from webdriverplus.webdriver import _SNAPSHOT_SCRIPT, _WAIT_SCRIPT, _CLEAR_STORAGE_SCRIPT
+from webdriverplus.webdriver import _WRITE_SCRIPT
+from webdriverplus.webelement import _HTML_SCRIPT, _INDEX_SCRIPT
+from webdriverplus.webelementset import _TRAVERSAL_SCRIPT, _FIND_SCRIPT, _SORT_SCRIPT
+from webdriverplus.webelementset import _MATCHES_SCRIPT, _PLUCK_SCRIPT
+from webdriverplus.webelementset import _FIND_ITER_SCRIPT, _COUNT_SCRIPT
+
+import base64
+import cgi
+import json
+import re
+import urllib
+import urllib2
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    etree = lxml_html = None
+
+try:
+    from lxml.cssselect import CSSSelector, SelectorError
+except ImportError:
+    CSSSelector = SelectorError = None
+
+
+_BLANK_PAGE = '<html><head></head><body></body></html>'
+
+_WINDOW_HANDLE = 'lxml'
+
+# Elements whose content is never rendered.
+_INVISIBLE_TAGS = frozenset(['head', 'script', 'style', 'noscript', 'template',
+                             'title', 'meta', 'link'])
+
+# Elements that start a new line of text.
+_BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'body', 'dd', 'div', 'dl',
+    'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2',
+    'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'html', 'li', 'main', 'nav', 'ol',
+    'p', 'pre', 'section', 'table', 'tbody', 'thead', 'tfoot', 'tr', 'ul',
+    'option', 'caption',
+])
+
+# Attributes that WebDriver reports as "true" or None.
+_BOOLEAN_ATTRIBUTES = frozenset([
+    'async', 'autofocus', 'autoplay', 'checked', 'compact', 'complete',
+    'controls', 'declare', 'defaultchecked', 'defaultselected', 'defer',
+    'disabled', 'draggable', 'ended', 'formnovalidate', 'hidden',
+    'indeterminate', 'iscontenteditable', 'ismap', 'itemscope', 'loop',
+    'multiple', 'muted', 'nohref', 'noresize', 'noshade', 'novalidate',
+    'nowrap', 'open', 'paused', 'pubdate', 'readonly', 'required',
+    'reversed', 'scoped', 'seamless', 'seeking', 'selected', 'spellcheck',
+    'truespeed', 'willvalidate',
+])
+
+_DISPLAY_NONE = re.compile(r'(^|;)\s*display\s*:\s*none\s*(;|$)', re.IGNORECASE)
+
+_compiled_css = LRUCache()
+
+
+class _CommandError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.status = code[0]
+
+
+def _unsupported(what):
+    return _CommandError(ErrorCode.UNKNOWN_COMMAND,
+                         "%s isn't supported by the lxml browser." % what)
+
+
+def _is_element(node):
+    return isinstance(node.tag, basestring)
+
+
+def _first_of(nodes):
+    for node in nodes:
+        return [node]
+    return []
+
+
+class LxmlConnection(object):
+    """
+    A command executor that runs WebDriver commands in-process, against
+    an lxml document.  Pages are loaded from file://, data: and http(s)://
+    URLs.  Responses go through JSON, as they would over the wire.
+    """
+
+    def __init__(self):
+        if lxml_html is None or CSSSelector is None:
+            raise Exception('The lxml browser requires lxml and cssselect.')
+        self._scripts = {
+            _FIND_SCRIPT: self._find_script,
+            _FIND_ITER_SCRIPT: self._find_iter_script,
+            _COUNT_SCRIPT: self._count_script,
+            _TRAVERSAL_SCRIPT: self._traversal_script,
+            _SORT_SCRIPT: self._sort_script,
+            _MATCHES_SCRIPT: self._matches_script,
+            _CHAIN_SCRIPT: self._chain_script,
+            _PLUCK_SCRIPT: self._pluck_script,
+            _SNAPSHOT_SCRIPT: self._snapshot_script,
+            _HTML_SCRIPT: self._html,
+            _INDEX_SCRIPT: self._index,
+            _CALL_SCRIPTS['attributes']: lambda elem: dict(elem.attrib),
+            _CALL_SCRIPTS['highlight']: lambda elems: None,
+            _CALL_SCRIPTS['unhighlight']: lambda elems: None,
+            _CLEAR_STORAGE_SCRIPT: lambda: None,
+            _WRITE_SCRIPT: lambda content: self._load(self.url, content),
+        }
+        self._page = 0
+        self._load('about:blank', _BLANK_PAGE)
+
+    def execute(self, command, params):
+        handler = getattr(self, '_cmd_' + command, None)
+        try:
+            if handler is None:
+                raise _unsupported("The '%s' command" % command)
+            value = handler(json.loads(json.dumps(params)))
+        except _CommandError, exc:
+            return {'status': exc.status, 'value': {'message': str(exc)}}
+        response = {'status': 0, 'sessionId': _WINDOW_HANDLE, 'value': value}
+        return json.loads(json.dumps(response))
+
+    # Documents.
+    def _load(self, url, content):
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        if not content.strip():
+            content = _BLANK_PAGE
+        try:
+            root = lxml_html.document_fromstring(content)
+        except etree.ParserError:
+            root = lxml_html.document_fromstring(_BLANK_PAGE)
+        self.url = url
+        self.tree = root.getroottree()
+        # Holding on to every element keeps lxml's proxy objects alive, so
+        # that elements can be compared by identity.
+        self._order = {}
+        for idx, elem in enumerate(root.iter(etree.Element)):
+            self._order[elem] = idx
+        self._ids = {}  # element --> id
+        self._elements = {}  # id --> element
+        self._queries = {}  # (css, xpath) --> matches in the document
+        self._results = {}  # key --> matches, for _FIND_ITER_SCRIPT
+        self._page += 1
+
+    def _fetch(self, url):
+        if url == 'about:blank':
+            return _BLANK_PAGE
+        if url.startswith('data:'):
+            header, data = url[5:].split(',', 1)
+            if header.endswith(';base64'):
+                return base64.b64decode(data)
+            return urllib.unquote(data)
+        try:
+            return urllib2.urlopen(url).read()
+        except (urllib2.URLError, ValueError, IOError), exc:
+            raise _CommandError(ErrorCode.UNKNOWN_ERROR,
+                                "Couldn't load '%s': %s" % (url, exc))
+
+    # Elements.
+    def _ref(self, elem):
+        if elem not in self._ids:
+            self._ids[elem] = '%d-%d' % (self._page, len(self._ids))
+            self._elements[self._ids[elem]] = elem
+        return {'ELEMENT': self._ids[elem]}
+
+    def _refs(self, elems):
+        return [self._ref(elem) for elem in elems]
+
+    def _element(self, element_id):
+        try:
+            return self._elements[element_id]
+        except KeyError:
+            raise _CommandError(ErrorCode.STALE_ELEMENT_REFERENCE,
+                                'Element is no longer attached to the DOM.')
+
+    def _resolve(self, value):
+        if isinstance(value, dict) and 'ELEMENT' in value:
+            return self._element(value['ELEMENT'])
+        if isinstance(value, list):
+            return [self._resolve(item) for item in value]
+        return value
+
+    def _sorted(self, elems):
+        return sorted(elems, key=self._order.get)
+
+    # Queries.
+    def _select(self, css, xpath):
+        """
+        Returns the matches for a query in the whole document, in document
+        order.  The document never changes, so the results are kept.
+        """
+        key = (css, xpath)
+        if key not in self._queries:
+            try:
+                if css:
+                    selector = _compiled_css.get(
+                        css, lambda: CSSSelector(css, translator='html'))
+                    found = selector(self.tree)
+                else:
+                    found = self.tree.xpath(xpath)
+            except (SelectorError, etree.XPathError), exc:
+                raise _CommandError(ErrorCode.INVALID_SELECTOR,
+                                    "Invalid selector '%s': %s" % (css or xpath, exc))
+            found = [node for node in found
+                     if not isinstance(node, basestring) and _is_element(node)]
+            self._queries[key] = (found, frozenset(found))
+        return self._queries[key]
+
+    def _query(self, context, css, xpath):
+        """
+        Returns the matches for a query in the context of an element,
+        or of the document if the context is None.
+
+        As with querySelectorAll(), CSS selectors are matched against the
+        whole document, and then limited to descendants of the context.
+        """
+        if context is None or context is self.tree:
+            return self._select(css, xpath)[0]
+        if css:
+            members = self._select(css, None)[1]
+            return [elem for elem in context.iterdescendants(etree.Element)
+                    if elem in members]
+        try:
+            found = context.xpath(xpath)
+        except etree.XPathError, exc:
+            raise _CommandError(ErrorCode.INVALID_SELECTOR,
+                                "Invalid selector '%s': %s" % (xpath, exc))
+        return [node for node in found
+                if not isinstance(node, basestring) and _is_element(node)]
+
+    def _find(self, context, using, value):
+        if using == 'css selector':
+            return self._query(context, value, None)
+        if using == 'xpath':
+            return self._query(context, None, value)
+        if using == 'tag name':
+            return self._query(context, value, None)
+        if using == 'id':
+            return self._query(context, None, './/*[@id=%s]' % xpath_literal(value))
+        if using == 'name':
+            return self._query(context, None, './/*[@name=%s]' % xpath_literal(value))
+        if using == 'class name':
+            return self._query(context, None, './/*[contains(concat(" ", '
+                               'normalize-space(@class), " "), %s)]' % xpath_literal(' %s ' % value))
+        if using in ('link text', 'partial link text'):
+            links = self._query(context, None, './/a')
+            if using == 'link text':
+                return [elem for elem in links if self._text(elem) == value]
+            return [elem for elem in links if value in self._text(elem)]
+        raise _unsupported("The '%s' locator" % using)
+
+    def _find_all(self, contexts, css, xpath):
+        if contexts is None or self.tree in contexts:
+            return self._select(css, xpath)[0]
+        found = set()
+        for context in contexts:
+            found.update(self._query(context, css, xpath))
+        return self._sorted(found)
+
+    def _matches(self, elem, css, test, xpath):
+        if css and elem not in self._select(css, None)[1]:
+            return False
+        if test and not elem.xpath(test):
+            return False
+        if xpath and elem not in self._select(None, xpath)[1]:
+            return False
+        return True
+
+    def _related(self, elem, axis):
+        if elem is self.tree:
+            # The document node, which is the starting point of a chain.
+            if axis == 'children':
+                return [self.tree.getroot()]
+            if axis == 'descendants':
+                return self.tree.getroot().iter(etree.Element)
+            return []
+        if axis == 'parent':
+            return [elem.getparent()]
+        if axis == 'children':
+            return elem.iterchildren(etree.Element)
+        if axis == 'descendants':
+            return elem.iterdescendants(etree.Element)
+        if axis == 'ancestors':
+            return elem.iterancestors(etree.Element)
+        if axis == 'next_all':
+            return elem.itersiblings(etree.Element)
+        if axis == 'prev_all':
+            return elem.itersiblings(etree.Element, preceding=True)
+        if axis == 'next':
+            return _first_of(elem.itersiblings(etree.Element))
+        if axis == 'prev':
+            return _first_of(elem.itersiblings(etree.Element, preceding=True))
+        return list(elem.itersiblings(etree.Element, preceding=True)) + \
+            list(elem.itersiblings(etree.Element))
+
+    def _traverse(self, elems, axis):
+        found = set()
+        for elem in elems:
+            found.update([node for node in self._related(elem, axis)
+                          if node is not None])
+        return self._sorted(found)
+
+    # Inspection.
+    def _is_displayed(self, elem):
+        if elem.tag == 'input' and (elem.get('type') or '').lower() == 'hidden':
+            return False
+        while elem is not None:
+            if elem.tag in _INVISIBLE_TAGS or elem.get('hidden') is not None or \
+               _DISPLAY_NONE.search(elem.get('style') or ''):
+                return False
+            elem = elem.getparent()
+        return True
+
+    def _text(self, elem):
+        """
+        The rendered text of an element: whitespace is collapsed, and
+        block level elements and <br> start new lines.
+        """
+        if not self._is_displayed(elem):
+            return ''
+        parts = []
+
+        def walk(node):
+            if node.tag in _INVISIBLE_TAGS or node.get('hidden') is not None or \
+               _DISPLAY_NONE.search(node.get('style') or ''):
+                return
+            block = node.tag in _BLOCK_TAGS
+            if block or node.tag == 'br':
+                parts.append('\n')
+            elif node.tag in ('td', 'th'):
+                parts.append(' ')
+            parts.append(node.text or '')
+            for child in node.iterchildren(etree.Element):
+                walk(child)
+                parts.append(child.tail or '')
+            if block:
+                parts.append('\n')
+
+        walk(elem)
+        lines = [' '.join(line.split()) for line in ''.join(parts).split('\n')]
+        return '\n'.join([line for line in lines if line])
+
+    def _attribute(self, elem, name):
+        if name == 'innerHTML':
+            return self._inner_html(elem)
+        if name in ('class', 'className'):
+            return elem.get('class')
+        if name.lower() in _BOOLEAN_ATTRIBUTES:
+            is_set = elem.get(name) is not None
+            if name == 'selected' and elem.tag == 'input':
+                is_set = elem.get('checked') is not None
+            return is_set and 'true' or None
+        if name == 'value':
+            if elem.tag == 'textarea':
+                return elem.text or ''
+            if elem.tag == 'option' and elem.get('value') is None:
+                return self._text(elem)
+            if elem.tag == 'input' and elem.get('value') is None and \
+               (elem.get('type') or '').lower() in ('checkbox', 'radio'):
+                return 'on'
+            if elem.tag in ('input', 'select', 'button') and elem.get('value') is None:
+                return ''
+        return elem.get(name)
+
+    def _inner_html(self, elem):
+        return cgi.escape(elem.text or '') + ''.join([
+            etree.tostring(child, method='html', encoding=unicode)
+            for child in elem.iterchildren()
+        ])
+
+    def _html(self, elem):
+        return etree.tostring(elem, method='html', encoding=unicode,
+                              with_tail=False)
+
+    def _index(self, elem):
+        return len(list(elem.itersiblings(etree.Element, preceding=True)))
+
+    def _is_selected(self, elem):
+        return elem.get('checked') is not None or elem.get('selected') is not None
+
+    def _is_enabled(self, elem):
+        return elem.get('disabled') is None
+
+    # Commands.
+    def _cmd_newSession(self, params):
+        return {'browserName': 'lxml', 'javascriptEnabled': True,
+                'takesScreenshot': False, 'cssSelectorsEnabled': True}
+
+    def _cmd_quit(self, params):
+        return None
+
+    def _cmd_close(self, params):
+        self._load('about:blank', _BLANK_PAGE)
+
+    def _cmd_get(self, params):
+        url = params['url']
+        self._load(url, self._fetch(url))
+
+    def _cmd_refresh(self, params):
+        self._load(self.url, self._fetch(self.url))
+
+    def _cmd_getCurrentUrl(self, params):
+        return self.url
+
+    def _cmd_getTitle(self, params):
+        title = self.tree.find('.//title')
+        if title is None:
+            return ''
+        return ' '.join((title.text or '').split())
+
+    def _cmd_getPageSource(self, params):
+        return etree.tostring(self.tree, method='html', encoding=unicode)
+
+    def _cmd_getWindowHandles(self, params):
+        return [_WINDOW_HANDLE]
+
+    def _cmd_getCurrentWindowHandle(self, params):
+        return _WINDOW_HANDLE
+
+    def _cmd_switchToWindow(self, params):
+        if params.get('name', params.get('handle')) != _WINDOW_HANDLE:
+            raise _CommandError(ErrorCode.NO_SUCH_WINDOW, 'No such window.')
+
+    def _cmd_getAllCookies(self, params):
+        return []
+
+    def _cmd_deleteAllCookies(self, params):
+        return None
+
+    def _cmd_getAlertText(self, params):
+        raise _CommandError(ErrorCode.NO_ALERT_OPEN, 'No alert is present.')
+
+    def _cmd_dismissAlert(self, params):
+        raise _CommandError(ErrorCode.NO_ALERT_OPEN, 'No alert is present.')
+
+    def _cmd_setTimeouts(self, params):
+        return None
+
+    def _cmd_setScriptTimeout(self, params):
+        return None
+
+    def _cmd_implicitlyWait(self, params):
+        return None
+
+    def _cmd_findElements(self, params):
+        return self._refs(self._find(None, params['using'], params['value']))
+
+    def _cmd_findElement(self, params):
+        return self._first(self._find(None, params['using'], params['value']))
+
+    def _cmd_findChildElements(self, params):
+        context = self._element(params['id'])
+        return self._refs(self._find(context, params['using'], params['value']))
+
+    def _cmd_findChildElement(self, params):
+        context = self._element(params['id'])
+        return self._first(self._find(context, params['using'], params['value']))
+
+    def _first(self, elems):
+        if not elems:
+            raise _CommandError(ErrorCode.NO_SUCH_ELEMENT, 'Unable to locate element.')
+        return self._ref(elems[0])
+
+    def _cmd_getElementText(self, params):
+        return self._text(self._element(params['id']))
+
+    def _cmd_getElementTagName(self, params):
+        return self._element(params['id']).tag
+
+    def _cmd_getElementAttribute(self, params):
+        return self._attribute(self._element(params['id']), params['name'])
+
+    def _cmd_isElementDisplayed(self, params):
+        return self._is_displayed(self._element(params['id']))
+
+    def _cmd_isElementSelected(self, params):
+        return self._is_selected(self._element(params['id']))
+
+    def _cmd_isElementEnabled(self, params):
+        return self._is_enabled(self._element(params['id']))
+
+    def _cmd_executeScript(self, params):
+        handler = self._scripts.get(params['script'])
+        if handler is None:
+            raise _CommandError(ErrorCode.JAVASCRIPT_ERROR,
+                                "The lxml browser can't run JavaScript.")
+        return handler(*self._resolve(params['args']))
+
+    def _cmd_executeAsyncScript(self, params):
+        if params['script'] != _WAIT_SCRIPT:
+            raise _CommandError(ErrorCode.JAVASCRIPT_ERROR,
+                                "The lxml browser can't run JavaScript.")
+        # The document never changes, so there's nothing to wait for.
+        css, xpath, timeout = params['args'][:3]
+        return self._refs(self._find_all(None, css, xpath)) or None
+
+    # Scripts.
+    def _find_script(self, elems, css, xpath):
+        return self._refs(self._find_all(elems, css, xpath))
+
+    def _find_iter_script(self, key, elems, css, xpath, offset, limit):
+        if key is None:
+            key = str(len(self._results) + 1)
+            while key in self._results:
+                key += '_'
+            self._results[key] = self._find_all(elems, css, xpath)
+        matches = self._results.get(key)
+        if matches is None or limit == 0:
+            self._results.pop(key, None)
+            return None
+        done = offset + limit >= len(matches)
+        if done:
+            del self._results[key]
+        return [key, done] + self._refs(matches[offset:offset + limit])
+
+    def _count_script(self, elems, css, xpath, exists):
+        found = self._find_all(elems, css, xpath)
+        if exists:
+            return int(bool(found))
+        return len(found)
+
+    def _traversal_script(self, elems, axis):
+        return self._refs(self._traverse(elems, axis))
+
+    def _sort_script(self, elems):
+        return self._refs(self._sorted(set(elems)))
+
+    def _matches_script(self, elems, css, test, xpath):
+        return [self._matches(elem, css, test, xpath) for elem in elems]
+
+    def _chain_script(self, context, steps):
+        current = context is None and [self.tree] or context
+        for step in steps:
+            if step[0] == 'find':
+                current = self._find_all(current, step[1], step[2])
+            elif step[0] == 'traverse':
+                current = self._traverse(current, step[1])
+            else:
+                keep = step[0] == 'filter'
+                current = [elem for elem in current
+                           if self._matches(elem, step[1], step[2], step[3]) == keep]
+        return self._refs([elem for elem in current if elem is not self.tree])
+
+    def _pluck(self, elem, name):
+        if name == 'text':
+            return self._text(elem)
+        if name == 'tag_name':
+            return elem.tag
+        if name == 'inner_html':
+            return self._inner_html(elem)
+        if name == 'html':
+            return self._html(elem)
+        if name == 'index':
+            return self._index(elem)
+        if name == 'is_checked':
+            return elem.get('checked') is not None
+        if name == 'is_selected':
+            return self._is_selected(elem)
+        if name == 'is_enabled':
+            return self._is_enabled(elem)
+        if name in ('rect', 'location', 'size'):
+            raise _unsupported('Layout')
+        return self._attribute(elem, name)
+
+    def _pluck_script(self, elems, names):
+        return [dict([(name, self._pluck(elem, name)) for name in names])
+                for elem in elems]
+
+    def _snapshot_script(self, elems, names):
+        # The document doesn't change until the next page is loaded.
+        return {'token': str(self._page), 'generation': 0,
+                'values': self._pluck_script(elems, names)}
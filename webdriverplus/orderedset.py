@@ -1,57 +1,122 @@
-## {{{ http://code.activestate.com/recipes/576694/ (r7)
 import collections
 
-KEY, PREV, NEXT = range(3)
-
 
 class OrderedSet(collections.MutableSet):
+    """
+    A set that remembers insertion order.
+
+    Keys are stored in a list, with a dict mapping each key to its position,
+    so membership tests, adding and indexing are all O(1).  Discarding a key
+    is O(n), as the positions of the following keys need updating.
+    """
     def __init__(self, iterable=None):
-        self.end = end = []
-        end += [None, end, end]         # sentinel node for doubly linked list
-        self.map = {}                   # key --> [key, prev, next]
+        self._items = []    # keys, in order
+        self._index = {}    # key --> position in self._items
         if iterable is not None:
-            self |= iterable
+            self._extend(iterable)
+
+    def _extend(self, iterable):
+        items, index = self._items, self._index
+        for key in iterable:
+            if key not in index:
+                index[key] = len(items)
+                items.append(key)
 
     def __len__(self):
-        return len(self.map)
+        return len(self._items)
 
     def __contains__(self, key):
-        return key in self.map
+        return key in self._index
 
     @property
     def _first(self):
-        return self.end[NEXT][KEY]
+        return self._items[0] if self._items else None
 
     def add(self, key):
-        if key not in self.map:
-            end = self.end
-            curr = end[PREV]
-            curr[NEXT] = end[PREV] = self.map[key] = [key, curr, end]
+        if key not in self._index:
+            self._index[key] = len(self._items)
+            self._items.append(key)
 
     def discard(self, key):
-        if key in self.map:
-            key, prev, next = self.map.pop(key)
-            prev[NEXT] = next
-            next[PREV] = prev
+        pos = self._index.pop(key, None)
+        if pos is not None:
+            del self._items[pos]
+            for idx in range(pos, len(self._items)):
+                self._index[self._items[idx]] = idx
+
+    def clear(self):
+        self._items = []
+        self._index = {}
+
+    # Bulk operations.  These avoid the per-element overhead of the
+    # MutableSet mixin methods, and keep the ordering of the left operand.
+    def _as_set(self, other):
+        if isinstance(other, (OrderedSet, set, frozenset, dict)):
+            return other
+        return set(other)
+
+    def _copy(self):
+        ret = self._from_iterable(())
+        ret._items = list(self._items)
+        ret._index = dict(self._index)
+        return ret
+
+    def _keep(self, items):
+        self._items = items
+        self._index = dict((key, idx) for idx, key in enumerate(items))
+
+    def update(self, *others):
+        for other in others:
+            self._extend(other)
+        return self
+
+    def intersection_update(self, other):
+        other = self._as_set(other)
+        self._keep([key for key in self._items if key in other])
+        return self
+
+    def difference_update(self, other):
+        other = self._as_set(other)
+        self._keep([key for key in self._items if key not in other])
+        return self
+
+    def __ior__(self, other):
+        return self.update(other)
+
+    def __iand__(self, other):
+        return self.intersection_update(other)
+
+    def __isub__(self, other):
+        return self.difference_update(other)
+
+    def __or__(self, other):
+        if not isinstance(other, collections.Iterable):
+            return NotImplemented
+        return self._copy().update(other)
+
+    def __and__(self, other):
+        if not isinstance(other, collections.Iterable):
+            return NotImplemented
+        return self._copy().intersection_update(other)
+
+    def __sub__(self, other):
+        if not isinstance(other, collections.Iterable):
+            return NotImplemented
+        return self._copy().difference_update(other)
 
     def __iter__(self):
-        end = self.end
-        curr = end[NEXT]
-        while curr is not end:
-            yield curr[KEY]
-            curr = curr[NEXT]
+        return iter(self._items)
 
     def __reversed__(self):
-        end = self.end
-        curr = end[PREV]
-        while curr is not end:
-            yield curr[KEY]
-            curr = curr[PREV]
+        return reversed(self._items)
+
+    def __getitem__(self, key):
+        return self._items[key]
 
     def pop(self, last=True):
         if not self:
             raise KeyError('set is empty')
-        key = next(reversed(self)) if last else next(iter(self))
+        key = self._items[-1] if last else self._items[0]
         self.discard(key)
         return key
 
@@ -62,13 +127,5 @@ class OrderedSet(collections.MutableSet):
 
     def __eq__(self, other):
         if isinstance(other, OrderedSet):
-            return len(self) == len(other) and list(self) == list(other)
+            return len(self) == len(other) and self._items == other._items
         return set(self) == set(other)
-
-    def __del__(self):
-        super(OrderedSet, self).clear()       # remove circular references
-
-
-if __name__ == '__main__':
-    print(OrderedSet('abracadaba'))
-    print(OrderedSet('simsalabim'))
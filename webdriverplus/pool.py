@@ -0,0 +1,237 @@
+import threading
+import time
+
+
+class BrowserPool(object):
+    """
+    A thread-safe pool of browser instances.
+
+    Instances are pooled by key, which is the browser name and the arguments
+    used to create it.  Each key may have several instances, so that parallel
+    test workers can each check out their own warm browser.
+    """
+
+    def __init__(self, max_size=None, idle_timeout=None, timeout=None):
+        self.max_size = max_size  # Maximum instances per key.
+        self.idle_timeout = idle_timeout  # Seconds before idle instances quit.
+        self.timeout = timeout  # Seconds to wait for a free instance.
+        self._lock = threading.Condition()
+        self._slots = []  # List of _Slot, one per key.
+
+    def _get_slot(self, key):
+        # Keys may not be hashable (eg. a firefox profile in the arguments),
+        # so we compare them by equality rather than using a dict.
+        for slot in self._slots:
+            if slot.key == key:
+                return slot
+        slot = _Slot(key)
+        self._slots.append(slot)
+        return slot
+
+    def _find_slot(self, driver):
+        for slot in self._slots:
+            if driver in slot.busy:
+                return slot
+            for idle_driver, returned in slot.idle:
+                if idle_driver is driver:
+                    return slot
+        return None
+
+    def _expired(self):
+        """
+        Removes and returns any instances that have been idle too long.
+        Must be called with the lock held.
+        """
+        if self.idle_timeout is None:
+            return []
+        ret = []
+        cutoff = time.time() - self.idle_timeout
+        for slot in self._slots:
+            ret.extend([driver for driver, returned in slot.idle if returned < cutoff])
+            slot.idle = [(driver, returned) for driver, returned in slot.idle
+                         if returned >= cutoff]
+        if ret:
+            self._lock.notifyAll()
+        return ret
+
+    def _quit(self, drivers):
+        for driver in drivers:
+            driver._pool = None
+            try:
+                driver.quit(force=True)
+            except Exception:
+                pass
+
+    def checkout(self, key, create):
+        """
+        Returns an idle instance for the key, or calls create() to start a
+        new one.  If the pool is full, waits for an instance to be returned.
+        """
+        deadline = self.timeout is not None and time.time() + self.timeout
+        self._lock.acquire()
+        try:
+            expired = self._expired()
+            slot = self._get_slot(key)
+            while True:
+                if slot.idle:
+                    driver, returned = slot.idle.pop()
+                    slot.busy.append(driver)
+                    break
+                # Don't start another instance if one that is being
+                # prewarmed could be used instead.
+                prewarm_pending = slot.warming > slot.waiting
+                if not prewarm_pending and \
+                   (self.max_size is None or slot.size < self.max_size):
+                    driver = None
+                    slot.pending += 1
+                    break
+                remaining = deadline and deadline - time.time()
+                if deadline and remaining <= 0:
+                    raise Exception('Timed out waiting for a pooled browser.')
+                slot.waiting += prewarm_pending
+                self._lock.wait(remaining or None)
+                slot.waiting -= prewarm_pending
+        finally:
+            self._lock.release()
+        self._quit(expired)
+
+        if driver is not None:
+            return driver
+
+        # Start the new instance outside of the lock, as it's slow.
+        try:
+            driver = create()
+        except:
+            self._lock.acquire()
+            slot.pending -= 1
+            self._lock.notifyAll()
+            self._lock.release()
+            raise
+
+        self._lock.acquire()
+        slot.pending -= 1
+        slot.busy.append(driver)
+        self._lock.release()
+        driver._pool = self
+        return driver
+
+    def prewarm(self, key, create, count=1):
+        """
+        Starts up to `count` new instances in background threads,
+        adding them to the pool as idle instances as they become ready.
+        Returns the list of threads.
+        """
+        self._lock.acquire()
+        try:
+            slot = self._get_slot(key)
+            if self.max_size is not None:
+                count = min(count, self.max_size - slot.size)
+            slot.warming += max(count, 0)
+        finally:
+            self._lock.release()
+
+        threads = []
+        for idx in range(count):
+            thread = threading.Thread(target=self._warm, args=(slot, create))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _warm(self, slot, create):
+        try:
+            driver = create()
+        except Exception:
+            driver = None
+        self._lock.acquire()
+        try:
+            slot.warming -= 1
+            if driver is not None:
+                driver._pool = self
+                slot.idle.append((driver, time.time()))
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def checkin(self, driver):
+        """
+        Resets the instance's state and returns it to the pool.
+        """
+        try:
+            driver.reset()
+        except Exception:
+            self.discard(driver)
+            self._quit([driver])
+            return
+
+        self._lock.acquire()
+        try:
+            slot = self._find_slot(driver)
+            if slot is not None and driver in slot.busy:
+                slot.busy.remove(driver)
+                slot.idle.append((driver, time.time()))
+            expired = self._expired()
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+        self._quit(expired)
+
+    def discard(self, driver):
+        """
+        Removes an instance from the pool, without quitting it.
+        """
+        self._lock.acquire()
+        try:
+            slot = self._find_slot(driver)
+            if slot is not None:
+                if driver in slot.busy:
+                    slot.busy.remove(driver)
+                slot.idle = [(idle, returned) for idle, returned in slot.idle
+                             if idle is not driver]
+            driver._pool = None
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Quits all idle instances.
+        """
+        self._lock.acquire()
+        try:
+            drivers = []
+            for slot in self._slots:
+                drivers.extend([driver for driver, returned in slot.idle])
+                slot.idle = []
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+        self._quit(drivers)
+
+    def drivers(self):
+        """
+        Returns a list of all the instances in the pool, busy or idle.
+        """
+        self._lock.acquire()
+        try:
+            ret = []
+            for slot in self._slots:
+                ret.extend(slot.busy)
+                ret.extend([driver for driver, returned in slot.idle])
+            return ret
+        finally:
+            self._lock.release()
+
+
+class _Slot(object):
+    def __init__(self, key):
+        self.key = key
+        self.idle = []  # List of (driver, time returned)
+        self.busy = []
+        self.pending = 0  # Instances currently starting up.
+        self.warming = 0  # Instances being prewarmed in the background.
+        self.waiting = 0  # Checkouts waiting for a prewarmed instance.
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.busy) + self.pending + self.warming
@@ -0,0 +1,157 @@
+from collections import namedtuple
+
+import os
+import sys
+import threading
+import time
+
+import selenium
+
+
+# One command sent to the browser.
+#   name:     The WebDriver command, eg. 'findElements'.
+#   duration: The round trip time in seconds.
+#   sent:     Size of the JSON parameters, in bytes.
+#   received: Size of the JSON response value, in bytes.
+#   caller:   The API method that sent the command, eg. 'WebElementSet.find'.
+#   location: The 'file:line' that called the API method.
+CommandRecord = namedtuple('CommandRecord', ['name', 'duration', 'sent',
+                                             'received', 'caller', 'location'])
+
+_LIBRARY_DIRS = (
+    os.path.dirname(os.path.abspath(__file__)),
+    os.path.dirname(os.path.abspath(selenium.__file__)),
+)
+
+# Plumbing that runs API methods on behalf of the caller, and so marks the
+# edge of an API call in the same way as the caller's own code does.
+_BOUNDARY_MODULES = (
+    os.path.join(_LIBRARY_DIRS[0], 'asynchronous'),
+    os.path.join(_LIBRARY_DIRS[0], 'utils'),
+)
+
+
+def _is_library(filename):
+    filename = os.path.abspath(filename)
+    if os.path.splitext(filename)[0] in _BOUNDARY_MODULES:
+        return False
+    return filename.startswith(_LIBRARY_DIRS)
+
+
+def _find_caller(frame):
+    """
+    Returns (caller, location) for the outermost webdriverplus or selenium
+    method on the stack, and the code that called it.
+    """
+    api = None
+    while frame is not None:
+        if not _is_library(frame.f_code.co_filename):
+            break
+        api = frame
+        frame = frame.f_back
+
+    if api is None:
+        return None, None
+    name = api.f_code.co_name
+    instance = api.f_locals.get('self')
+    if instance is not None:
+        name = '%s.%s' % (type(instance).__name__, name)
+    location = None
+    if frame is not None:
+        location = '%s:%d' % (os.path.basename(frame.f_code.co_filename),
+                              frame.f_lineno)
+    return name, location
+
+
+class Profile(object):
+    """
+    Records every command sent to the browser while it is active.
+
+        with driver.profile() as profile:
+            driver.find('li').pluck('text')
+        print profile.report()
+
+    If `max_commands` is set, an AssertionError is raised on leaving the
+    block if more commands than that were sent.
+    """
+    def __init__(self, webdriver, max_commands=None):
+        self._webdriver = webdriver
+        self.max_commands = max_commands
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._webdriver._profiles.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._webdriver._profiles.remove(self)
+        if exc_type is None and self.max_commands is not None and \
+           len(self.records) > self.max_commands:
+            raise AssertionError('%d commands sent, the budget is %d.\n%s' %
+                                 (len(self.records), self.max_commands,
+                                  self.report()))
+
+    def _add(self, record):
+        self._lock.acquire()
+        try:
+            self.records.append(record)
+        finally:
+            self._lock.release()
+
+    @property
+    def commands(self):
+        return len(self.records)
+
+    @property
+    def duration(self):
+        return sum([record.duration for record in self.records])
+
+    def by_caller(self):
+        """
+        Returns a list of (caller, location, commands, duration, sent,
+        received) tuples, with the callers that sent the most commands first.
+        """
+        totals = {}
+        order = []
+        for record in self.records:
+            key = (record.caller, record.location)
+            if key not in totals:
+                totals[key] = [0, 0.0, 0, 0]
+                order.append(key)
+            total = totals[key]
+            total[0] += 1
+            total[1] += record.duration
+            total[2] += record.sent
+            total[3] += record.received
+        ret = [ident + tuple(totals[ident]) for ident in order]
+        ret.sort(key=lambda row: -row[2])
+        return ret
+
+    def report(self):
+        lines = ['%-32s %-24s %8s %10s %10s %10s' %
+                 ('caller', 'location', 'commands', 'time (ms)', 'sent', 'received')]
+        for caller, location, commands, duration, sent, received in self.by_caller():
+            lines.append('%-32s %-24s %8d %10.1f %10d %10d' %
+                         (caller, location, commands, duration * 1000, sent, received))
+        lines.append('%d commands in %.1f ms' % (self.commands, self.duration * 1000))
+        return '\n'.join(lines)
+
+
+class _Timer(object):
+    """
+    Times a single command, for each of the active profiles.
+    """
+    def __init__(self, profiles, name, sent):
+        self.profiles = profiles
+        self.name = name
+        self.sent = sent
+        self.received = 0
+        self.caller, self.location = _find_caller(sys._getframe(2))
+        self.start = time.time()
+
+    def finish(self):
+        record = CommandRecord(self.name, time.time() - self.start, self.sent,
+                               self.received, self.caller, self.location)
+        for profile in self.profiles:
+            profile._add(record)
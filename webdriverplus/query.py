@@ -0,0 +1,208 @@
+from webdriverplus.selectors import SelectorMixin
+from webdriverplus.webelementset import WebElementSet
+from webdriverplus.webelementset import _NODE_SET_JS, _AXES_JS, _QUERY_JS, _MATCH_JS
+
+
+# Runs a list of compiled steps, starting from a list of elements,
+# or from the document if the context is null.
+_CHAIN_SCRIPT = _NODE_SET_JS + _AXES_JS + _QUERY_JS + _MATCH_JS + """
+    var context = arguments[0], steps = arguments[1];
+    var current = context === null ? [document] : context;
+    var i, j, step;
+
+    for (i = 0; i < steps.length; i++) {
+        step = steps[i];
+        if (step[0] === 'find') {
+            ret = [];
+            for (j = 0; j < current.length; j++) {
+                query(current[j], step[1], step[2]);
+            }
+            current = result();
+        } else if (step[0] === 'traverse') {
+            ret = [];
+            for (j = 0; j < current.length; j++) {
+                axes[step[1]](current[j]);
+            }
+            current = result();
+        } else {
+            var keep = step[0] === 'filter', filtered = [];
+            var xpathMembers = members(step[3]);
+            for (j = 0; j < current.length; j++) {
+                if (matches(current[j], step[1], step[2], step[3], xpathMembers) === keep) {
+                    filtered.push(current[j]);
+                }
+            }
+            current = filtered;
+        }
+    }
+    return current;
+"""
+
+
+class Query(SelectorMixin):
+    """
+    A lazily evaluated WebElementSet.
+
+    Finds, traversals and filters are recorded rather than run, and the
+    whole chain is run in the browser with a single script call the first
+    time the result is needed (when iterated, indexed, acted on etc...)
+
+    Steps that can't be run as a script (eg. find(link_text=...)) are run
+    one at a time, in between the compiled parts of the chain.
+    """
+
+    def __init__(self, webdriver, context=None, steps=()):
+        self._webdriver = webdriver
+        self._context = context  # None for the document, or a list of elements.
+        self._steps = list(steps)  # List of (method, args, kwargs, compiled)
+        self._result = None
+
+    @property
+    def _xpath_prefix(self):
+        return './/*'
+
+    def _chain(self, method, args, kwargs, compiled):
+        step = (method, args, kwargs, compiled)
+        if self._result is not None:
+            # Already evaluated, so carry on from the result.
+            return Query(self._webdriver, list(self._result), [step])
+        return Query(self._webdriver, self._context, self._steps + [step])
+
+    def _compile_find(self, kwargs):
+        query = self._get_script_query(kwargs)
+        return query and ['find', query[0], query[1]]
+
+    def _compile_filter(self, method, kwargs):
+        css, test, xpath, remaining = self._get_matcher(kwargs)
+        if remaining:
+            return None
+        return [method, css, test, xpath]
+
+    # Recording.
+    def find(self, css=None, **kwargs):
+        if css:
+            kwargs['css'] = css
+        assert kwargs, 'no selector argument supplied.'
+        return self._chain('find', (), kwargs, self._compile_find(kwargs))
+
+    def filter(self, css=None, **kwargs):
+        if css:
+            kwargs['css'] = css
+        if not kwargs:
+            return self
+        return self._chain('filter', (), kwargs,
+                           self._compile_filter('filter', kwargs))
+
+    def exclude(self, css=None, **kwargs):
+        if css:
+            kwargs['css'] = css
+        if not kwargs:
+            return self
+        return self._chain('exclude', (), kwargs,
+                           self._compile_filter('exclude', kwargs))
+
+    def _traversal(self, axis, args, kwargs):
+        ret = self._chain(axis, (), {}, ['traverse', axis])
+        return ret.filter(*args, **kwargs)
+
+    def parent(self, *args, **kwargs):
+        return self._traversal('parent', args, kwargs)
+
+    def children(self, *args, **kwargs):
+        return self._traversal('children', args, kwargs)
+
+    def descendants(self):
+        return self._traversal('descendants', (), {})
+
+    def ancestors(self, *args, **kwargs):
+        return self._traversal('ancestors', args, kwargs)
+
+    def next(self, *args, **kwargs):
+        return self._traversal('next', args, kwargs)
+
+    def prev(self, *args, **kwargs):
+        return self._traversal('prev', args, kwargs)
+
+    def next_all(self, *args, **kwargs):
+        return self._traversal('next_all', args, kwargs)
+
+    def prev_all(self, *args, **kwargs):
+        return self._traversal('prev_all', args, kwargs)
+
+    def siblings(self, *args, **kwargs):
+        return self._traversal('siblings', args, kwargs)
+
+    # Evaluation.
+    def _run_script(self, context, compiled):
+        elems = self._webdriver.execute_script(_CHAIN_SCRIPT, context, compiled)
+        return WebElementSet(self._webdriver, elems)
+
+    def _run_step(self, context, method, args, kwargs):
+        if context is None:
+            target = self._webdriver
+        else:
+            target = WebElementSet(self._webdriver, context)
+        return getattr(target, method)(*args, **dict(kwargs))
+
+    def _evaluate(self):
+        if self._result is not None:
+            return self._result
+
+        context = self._context
+        compiled = []
+        use_script = self._webdriver._javascript_enabled
+        for method, args, kwargs, step in self._steps:
+            if context is not None and not context:
+                break
+            if use_script and step is not None:
+                compiled.append(step)
+                continue
+            if compiled:
+                context = list(self._run_script(context, compiled))
+                compiled = []
+            context = list(self._run_step(context, method, args, kwargs))
+        if compiled and (context is None or context):
+            self._result = self._run_script(context, compiled)
+        else:
+            self._result = WebElementSet(self._webdriver, context or [])
+        return self._result
+
+    # Anything else acts on the evaluated result.
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_webdriver', '_context',
+                                             '_steps', '_result'):
+            raise AttributeError(name)
+        return getattr(self._evaluate(), name)
+
+    def __iter__(self):
+        return iter(self._evaluate())
+
+    def __len__(self):
+        return len(self._evaluate())
+
+    def __nonzero__(self):
+        return bool(self._evaluate())
+
+    def __contains__(self, elem):
+        return elem in self._evaluate()
+
+    def __getitem__(self, key):
+        return self._evaluate()[key]
+
+    def __eq__(self, other):
+        return self._evaluate() == other
+
+    def __ne__(self, other):
+        return self._evaluate() != other
+
+    def __or__(self, other):
+        return self._evaluate() | other
+
+    def __and__(self, other):
+        return self._evaluate() & other
+
+    def __sub__(self, other):
+        return self._evaluate() - other
+
+    def __repr__(self):
+        return repr(self._evaluate())
@@ -1,6 +1,9 @@
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 
+import re
+import threading
+
 
 def xpath_literal(s):
     """
@@ -13,7 +16,144 @@ def xpath_literal(s):
     return "concat('%s')" % s.replace("'", "',\"'\",'")
 
 
+def css_literal(s):
+    """
+    Quote a string for use as a CSS attribute value.
+    """
+    s = s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\a ')
+    return '"%s"' % s
+
+
+_CSS_IDENTIFIER = re.compile(r'^-?[_a-zA-Z][_a-zA-Z0-9-]*$')
+
+# A single compound selector, using only a tag name, ids and classes.
+# Eg. 'li', '.selected', 'input#username', 'li.first.selected'
+_SIMPLE_CSS = re.compile(r'^([a-zA-Z][a-zA-Z0-9]*)?((?:[#.]-?[_a-zA-Z][_a-zA-Z0-9-]*)*)$')
+_SIMPLE_CSS_PART = re.compile(r'([#.])(-?[_a-zA-Z][_a-zA-Z0-9-]*)')
+
+
+def _class_predicate(val):
+    return "[contains(concat(' ', normalize-space(@class), ' '), %s)]" % \
+        xpath_literal(' %s ' % val)
+
+
+def _css_to_xpath_predicates(css):
+    """
+    Translate a simple CSS selector into a list of xpath predicates.
+    Returns None if the selector is too complex to translate.
+    """
+    match = _SIMPLE_CSS.match(css.strip())
+    if not match or not css.strip():
+        return None
+    tag_name, rest = match.groups()
+    ret = []
+    if tag_name:
+        ret.append('[local-name()=%s]' % xpath_literal(tag_name.lower()))
+    for prefix, name in _SIMPLE_CSS_PART.findall(rest):
+        if prefix == '#':
+            ret.append('[@id=%s]' % xpath_literal(name))
+        else:
+            ret.append(_class_predicate(name))
+    return ret
+
+
+class LRUCache(object):
+    """
+    A thread-safe, size bounded cache, which discards the least recently
+    used entries first.  Keeps a count of hits and misses.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._data = {}  # key --> [prev, next, key, value]
+        self._root = root = []  # Sentinel of a circular linked list.
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, compute):
+        """
+        Returns the cached value for key, or calls compute() and caches
+        the result.
+        """
+        self._lock.acquire()
+        try:
+            link = self._data.get(key)
+            if link is not None:
+                # Move to the most recently used end.
+                prev, next = link[0], link[1]
+                prev[1], next[0] = next, prev
+                root = self._root
+                last = root[0]
+                link[0], link[1] = last, root
+                last[1] = root[0] = link
+                self.hits += 1
+                return link[3]
+            self.misses += 1
+        finally:
+            self._lock.release()
+
+        value = compute()
+
+        self._lock.acquire()
+        try:
+            if key not in self._data:
+                root = self._root
+                last = root[0]
+                link = [last, root, key, value]
+                last[1] = root[0] = self._data[key] = link
+                if self.maxsize is not None and len(self._data) > self.maxsize:
+                    oldest = root[1]
+                    root[1], oldest[1][0] = oldest[1], root
+                    del self._data[oldest[2]]
+        finally:
+            self._lock.release()
+        return value
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+
+# Compiled selectors, shared by all drivers, elements and sets.
+selector_cache = LRUCache()
+
+
+def _cached(func):
+    """
+    Caches the result of a selector compiling method, keyed on the
+    method, the xpath prefix and the selector arguments.
+    The cached results are shared, so must not be modified by callers.
+    """
+    name = func.__name__
+
+    def wrapped(self, kwargs):
+        try:
+            key = (name, self._xpath_prefix, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            # Unhashable argument values, eg. attribute_value as a list.
+            return func(self, kwargs)
+        return self._selector_cache.get(key, lambda: func(self, kwargs))
+    wrapped.__name__ = name
+    wrapped.__doc__ = func.__doc__
+    return wrapped
+
+
+def _timeout_message(wait, kwargs):
+    selector = ', '.join(['%s=%r' % item for item in sorted(kwargs.items())])
+    return 'No elements matching (%s) after waiting %s seconds.' % (selector, wait)
+
+
 class SelectorMixin(object):
+    _selector_cache = selector_cache
+
     _ARG_TO_SELECTOR = {
         'id':
             lambda self, val: (By.ID, val),
@@ -63,25 +203,210 @@ class SelectorMixin(object):
         # TODO: label, label_contains
     }
 
-    def _get_selector(self, **kwargs):
+    # Selector arguments that can be expressed as an xpath predicate,
+    # so that several of them can be combined into a single query.
+    _ARG_TO_XPATH_PREDICATE = {
+        'id':
+            lambda val: '[@id=%s]' % xpath_literal(val),
+        'name':
+            lambda val: '[@name=%s]' % xpath_literal(val),
+        'tag_name':
+            lambda val: '[local-name()=%s]' % xpath_literal(val.lower()),
+        'class_name':
+            _class_predicate,
+        'css':
+            _css_to_xpath_predicates,
+        'attribute':
+            lambda val: '[@%s]' % val,
+        'attribute_value':
+            lambda val: '[@%s=%s]' % (val[0], xpath_literal(val[1])),
+        'text':
+            lambda val: '[text()=%s]' % xpath_literal(val),
+        'text_contains':
+            lambda val: '[text()[contains(.,%s)]]' % xpath_literal(val),
+        'value':
+            lambda val: '[@value=%s]' % xpath_literal(val),
+        'type':
+            lambda val: '[@type=%s]' % xpath_literal(val),
+        'checked':
+            lambda val: '[@checked]' if val else '[not(@checked)]',
+        'selected':
+            lambda val: '[@selected]' if val else '[not(@selected)]',
+    }
+
+    # Selector arguments that can be appended to a CSS selector.
+    # ('tag_name' and 'css' are dealt with separately.)
+    _ARG_TO_CSS = {
+        'id':
+            lambda val: '[id=%s]' % css_literal(val),
+        'name':
+            lambda val: '[name=%s]' % css_literal(val),
+        'class_name':
+            lambda val: '[class~=%s]' % css_literal(val),
+        'attribute':
+            lambda val: _CSS_IDENTIFIER.match(val) and '[%s]' % val,
+        'attribute_value':
+            lambda val: _CSS_IDENTIFIER.match(val[0]) and
+                        '[%s=%s]' % (val[0], css_literal(val[1])),
+        'value':
+            lambda val: '[value=%s]' % css_literal(val),
+        'type':
+            lambda val: '[type=%s]' % css_literal(val),
+        'checked':
+            lambda val: '[checked]' if val else ':not([checked])',
+        'selected':
+            lambda val: '[selected]' if val else ':not([selected])',
+    }
+
+    def _compile_css(self, kwargs):
+        """
+        Returns a single CSS selector matching all of kwargs,
+        or None if they can't be expressed in CSS.
+        """
+        css = kwargs.get('css')
+        css = css and css.strip()
+        tag_name = kwargs.get('tag_name')
+        if css is not None and (tag_name is not None or ',' in css):
+            return None
+        if tag_name is not None and not _CSS_IDENTIFIER.match(tag_name):
+            return None
+
+        ret = [css or tag_name or '*']
         for arg, value in kwargs.items():
-            func = self._ARG_TO_SELECTOR.get(arg, None)
-            assert func, "'%s' is not a valid selector argument." % arg
-            yield func(self, value)  # (selector, value) tuple
+            if arg in ('css', 'tag_name'):
+                continue
+            func = self._ARG_TO_CSS.get(arg, None)
+            selector = func and func(value)
+            if not selector:
+                return None
+            ret.append(selector)
+        return ''.join(ret)
+
+    def _get_predicates(self, kwargs):
+        """
+        Splits kwargs into a list of xpath predicates, and a dict of any
+        remaining arguments that can't be expressed as predicates.
+        """
+        predicates = []
+        remaining = {}
+        # Put the most selective predicates first.
+        items = sorted(kwargs.items(),
+                       key=lambda item: (item[0] not in ('tag_name', 'css', 'id'), item[0]))
+        for arg, value in items:
+            func = self._ARG_TO_XPATH_PREDICATE.get(arg, None)
+            predicate = func and func(value)
+            if not predicate:
+                remaining[arg] = value
+            elif isinstance(predicate, list):
+                predicates.extend(predicate)
+            else:
+                predicates.append(predicate)
+        return predicates, remaining
+
+    def _compile_xpath(self, kwargs):
+        """
+        Combines as many of kwargs as possible into a single xpath query.
+        Returns a list of (selector, value) tuples, which should be
+        intersected to get the result.
+        """
+        predicates, remaining = self._get_predicates(kwargs)
+        xpath = remaining.pop('xpath', None)
+        ret = [self._ARG_TO_SELECTOR[arg](self, value)
+               for arg, value in remaining.items()]
+
+        if predicates:
+            base = '(%s)' % xpath if xpath else self._xpath_prefix
+            ret.insert(0, (By.XPATH, base + ''.join(predicates)))
+        elif xpath:
+            ret.insert(0, (By.XPATH, xpath))
+        return ret
+
+    @_cached
+    def _get_matcher(self, kwargs):
+        """
+        Returns a (css, test, xpath, remaining) tuple, for testing
+        individual elements against kwargs in the browser.
+
+        css:       A CSS selector the element must match, or None.
+        test:      An xpath expression that must be true with the element
+                   as the context node, or None.
+        xpath:     An xpath query the element must be a member of, or None.
+        remaining: A dict of any arguments that can only be tested by
+                   querying the document.
+        """
+        css = self._compile_css(kwargs)
+        if css is not None:
+            return css, None, None, {}
+        predicates, remaining = self._get_predicates(kwargs)
+        css = remaining.pop('css', None)
+        xpath = remaining.pop('xpath', None)
+        test = predicates and 'self::*' + ''.join(predicates) or None
+        return css, test, xpath, remaining
+
+    @_cached
+    def _get_script_query(self, kwargs):
+        """
+        Returns a (css, xpath) tuple, with exactly one of the two set,
+        for evaluating kwargs inside the browser.  Returns None if
+        kwargs can't be expressed as a single CSS or xpath query.
+        """
+        css = self._compile_css(kwargs)
+        if css is not None:
+            return css, None
+        selectors = self._compile_xpath(kwargs)
+        if len(selectors) == 1 and selectors[0][0] == By.XPATH:
+            return None, selectors[0][1]
+        return None
+
+    def _check_selector(self, kwargs):
+        """
+        Asserts that kwargs are a valid, non-empty set of selector arguments.
+        """
+        assert kwargs, 'no selector argument supplied.'
+        for arg in kwargs:
+            assert arg in self._ARG_TO_SELECTOR, \
+                "'%s' is not a valid selector argument." % arg
+
+    def _get_selector(self, **kwargs):
+        """
+        Returns a list of (selector, value) tuples for the given arguments.
+
+        Multiple arguments are combined into a single CSS or xpath query
+        wherever possible, so that they can be evaluated in one round trip.
+        """
+        self._check_selector(kwargs)
+        return self._compile_selector(kwargs)
+
+    @_cached
+    def _compile_selector(self, kwargs):
+        if len(kwargs) == 1:
+            arg, value = kwargs.items()[0]
+            return [self._ARG_TO_SELECTOR[arg](self, value)]
+
+        css = self._compile_css(kwargs)
+        if css is not None:
+            return [(By.CSS_SELECTOR, css)]
+        return self._compile_xpath(kwargs)
 
     def find(self, *args, **kwargs):
         wait = getattr(self, 'wait', 0)
         if wait:
-            return WebDriverWait(self, wait).until(
-                lambda selector: selector._find_nowait(*args, **kwargs)
-            )
+            return self._find_wait(wait, *args, **kwargs)
         else:
             return self._find_nowait(*args, **kwargs)
 
+    def _find_wait(self, wait, *args, **kwargs):
+        described = dict(kwargs)
+        if args:
+            described['css'] = args[0]
+        return WebDriverWait(self, wait).until(
+            lambda selector: selector._find_nowait(*args, **kwargs),
+            _timeout_message(wait, described)
+        )
+
     def _find_nowait(self, css=None, **kwargs):
         if css:
             kwargs['css'] = css
-        assert kwargs, 'no selector argument supplied.'
 
         elems = None
         for selector, value in self._get_selector(**kwargs):
@@ -92,6 +417,47 @@ class SelectorMixin(object):
                 elems = self.find_elements(by=selector, value=value)
         return elems
 
+    def find_iter(self, css=None, chunk_size=500, **kwargs):
+        """
+        Like find(), but returns an iterator over the matching elements,
+        which are fetched from the browser `chunk_size` at a time.
+        """
+        if css:
+            kwargs['css'] = css
+        self._check_selector(kwargs)
+        webdriver, context = self._script_context
+        query = webdriver._javascript_enabled and self._get_script_query(kwargs)
+        if not query:
+            return iter(self.find(**kwargs))
+        return webdriver._iter_matches(context, query, chunk_size)
+
+    def _count(self, kwargs, exists):
+        webdriver, context = self._script_context
+        query = webdriver._javascript_enabled and self._get_script_query(kwargs)
+        if not query:
+            return len(self._find_nowait(**kwargs))
+        return webdriver._count_matches(context, query, exists)
+
+    def count(self, css=None, **kwargs):
+        """
+        Returns the number of matching elements, without fetching them.
+        Doesn't wait for elements to appear.
+        """
+        if css:
+            kwargs['css'] = css
+        self._check_selector(kwargs)
+        return self._count(kwargs, False)
+
+    def exists(self, css=None, **kwargs):
+        """
+        Returns True if there are any matching elements, without fetching
+        them.  Doesn't wait for elements to appear.
+        """
+        if css:
+            kwargs['css'] = css
+        self._check_selector(kwargs)
+        return bool(self._count(kwargs, True))
+
     #def find_all(self, css=None, **kwargs):
     #    (selector, value) = self._get_selector(css, **kwargs)
     #    return self.find_elements(by=selector, value=value)
@@ -0,0 +1,89 @@
+import BaseHTTPServer
+import SocketServer
+import itertools
+import threading
+
+
+class _PageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        content = self.server.pages.get(self.path.split('?', 1)[0])
+        if content is None:
+            self.send_response(404)
+            content = ''
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class PageServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A local HTTP server that serves pages from memory, so that `open()`
+    doesn't need to write each page to a temporary file.
+
+    Each owner (eg. a WebDriver instance) has one page at a time, which is
+    replaced by the next page it adds.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _PageHandler)
+        self.url = 'http://%s:%d' % self.server_address
+        self.pages = {}  # path --> content
+        self._paths = {}  # owner --> path
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def add(self, owner, content):
+        """
+        Serves `content` in place of the owner's previous page,
+        and returns its URL.
+        """
+        path = '/page/%d' % self._counter.next()
+        self._lock.acquire()
+        try:
+            self.pages.pop(self._paths.get(owner), None)
+            self.pages[path] = content
+            self._paths[owner] = path
+        finally:
+            self._lock.release()
+        return self.url + path
+
+    def remove(self, owner):
+        """
+        Stops serving the owner's page.
+        """
+        self._lock.acquire()
+        try:
+            self.pages.pop(self._paths.pop(owner, None), None)
+        finally:
+            self._lock.release()
+
+
+_page_server = None
+_page_server_lock = threading.Lock()
+
+
+def get_page_server():
+    """
+    Returns the shared PageServer, starting it the first time it is needed.
+    """
+    global _page_server
+    _page_server_lock.acquire()
+    try:
+        if _page_server is None:
+            _page_server = PageServer()
+        return _page_server
+    finally:
+        _page_server_lock.release()
@@ -0,0 +1,152 @@
+from selenium.webdriver.remote import utils
+from selenium.webdriver.remote.errorhandler import ErrorCode
+from selenium.webdriver.remote.remote_connection import RemoteConnection
+
+from webdriverplus.utils import run_concurrently
+
+import base64
+import httplib
+import socket
+import threading
+import urlparse
+
+
+class PooledConnection(RemoteConnection):
+    """
+    A RemoteConnection that keeps a pool of persistent HTTP connections
+    to the server, rather than opening a new socket for each command.
+
+    Up to `size` commands may be in flight at once, so independent
+    commands can be sent concurrently using `pipeline()`.
+    """
+
+    def __init__(self, remote_server_addr, size=4, timeout=None):
+        RemoteConnection.__init__(self, remote_server_addr)
+        self.size = size
+        self.timeout = timeout  # Socket timeout in seconds.
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = {}  # (scheme, netloc) --> list of idle connections
+
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            cls = httplib.HTTPSConnection
+        else:
+            cls = httplib.HTTPConnection
+        netloc = netloc.rsplit('@', 1)[-1]
+        if self.timeout is None:
+            return cls(netloc)
+        return cls(netloc, timeout=self.timeout)
+
+    def _checkout(self, key):
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        finally:
+            self._lock.release()
+        return self._connect(*key), False
+
+    def _checkin(self, key, conn):
+        self._lock.acquire()
+        try:
+            self._idle.setdefault(key, []).append(conn)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        Closes all the idle connections.
+        """
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _get_headers(self, parsed_url):
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json;charset=UTF-8',
+            'Connection': 'keep-alive',
+        }
+        if parsed_url.username:
+            auth = '%s:%s' % (parsed_url.username, parsed_url.password or '')
+            headers['Authorization'] = 'Basic %s' % base64.b64encode(auth)
+        return headers
+
+    def _send(self, method, url, body):
+        """
+        Sends a request over a pooled connection, and returns a tuple of
+        (status, content type, location, data).
+        """
+        parsed_url = urlparse.urlparse(url)
+        key = (parsed_url.scheme, parsed_url.netloc)
+        path = parsed_url.path
+        if parsed_url.query:
+            path += '?' + parsed_url.query
+        headers = self._get_headers(parsed_url)
+
+        self._slots.acquire()
+        try:
+            while True:
+                conn, reused = self._checkout(key)
+                try:
+                    conn.request(method, path, body, headers)
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    # The server may have closed an idle connection,
+                    # in which case try again with a fresh one.
+                    if reused:
+                        continue
+                    raise
+                break
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+        finally:
+            self._slots.release()
+        return (resp.status, resp.getheader('Content-Type'),
+                resp.getheader('Location'), data)
+
+    def _request(self, method, url, body=None):
+        if body and method not in ('POST', 'PUT'):
+            body = None
+
+        status, content_type, location, data = self._send(method, url, body)
+        data = data.decode('UTF-8')
+
+        if 300 <= status < 304:
+            return self._request('GET', urlparse.urljoin(url, location))
+        if 399 < status <= 500:
+            return {'status': status, 'value': data}
+        if content_type and content_type.startswith('image/png'):
+            return {'status': 0, 'value': data}
+        try:
+            data = utils.load_json(data.strip())
+        except ValueError:
+            if 199 < status < 300:
+                status = ErrorCode.SUCCESS
+            else:
+                status = ErrorCode.UNKNOWN_ERROR
+            return {'status': status, 'value': data.strip()}
+        if 'value' not in data:
+            data['value'] = None
+        return data
+
+    def pipeline(self, commands):
+        """
+        Sends a list of independent (command, params) pairs concurrently,
+        and returns the list of responses, in the same order.
+        """
+        return run_concurrently([
+            lambda command=command, params=params: self.execute(command, params)
+            for command, params in commands
+        ], self.size)
@@ -1,4 +1,6 @@
 import os
+import sys
+import threading
 import urllib2
 
 
@@ -53,3 +55,47 @@ def get_terminal_size():
         except:
             cr = (25, 80)
     return int(cr[1]), int(cr[0])
+
+
+def run_concurrently(funcs, workers):
+    """
+    Calls each of funcs using up to `workers` threads, and returns the list
+    of results, in the same order as funcs.  If any of the calls raise an
+    exception, the first one is re-raised once all the calls have finished.
+    """
+    funcs = list(funcs)
+    workers = min(workers, len(funcs))
+    if workers <= 1:
+        return [func() for func in funcs]
+
+    results = [None] * len(funcs)
+    errors = [None] * len(funcs)
+    pending = list(enumerate(funcs))
+    pending.reverse()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not pending:
+                    return
+                idx, func = pending.pop()
+            finally:
+                lock.release()
+            try:
+                results[idx] = func()
+            except Exception:
+                errors[idx] = sys.exc_info()
+
+    threads = [threading.Thread(target=worker) for idx in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for error in errors:
+        if error is not None:
+            raise error[0], error[1], error[2]
+    return results
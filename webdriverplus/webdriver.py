@@ -1,59 +1,453 @@
-from webdriverplus.webelement import WebElement
+from webdriverplus.webelement import WebElement, _HTML_SCRIPT, _INDEX_SCRIPT
 from webdriverplus.webelementset import WebElementSet
-from webdriverplus.selectors import SelectorMixin
+from webdriverplus.webelementset import _TRAVERSAL_SCRIPT, _FIND_SCRIPT, _SORT_SCRIPT
+from webdriverplus.webelementset import _MATCHES_SCRIPT, _PLUCK_SCRIPT, _CSS_SCRIPT
+from webdriverplus.webelementset import _FIND_ITER_SCRIPT, _COUNT_SCRIPT
+from webdriverplus.helpers import _CALL_SCRIPTS, _HELPERS_MISSING
+from webdriverplus.helpers import _INSTALL_AND_CALL_SCRIPTS
+from webdriverplus.profiler import Profile, _Timer
+from webdriverplus.selectors import SelectorMixin, _timeout_message
+from webdriverplus.server import get_page_server
+from webdriverplus.query import Query, _CHAIN_SCRIPT
+from webdriverplus.transport import PooledConnection
+from webdriverplus.utils import run_concurrently
 
+import json
 import re
 import tempfile
+import threading
+import time
+import urlparse
 
 from selenium.common.exceptions import StaleElementReferenceException
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.remote.command import Command
+
+
+# Cheap properties, which are fetched together the first time any of them
+# is read.  Other snapshot properties, such as 'html' and 'inner_html',
+# which serialise the element's subtree, are only fetched when read.
+_SNAPSHOT_PROPERTIES = ['id', 'type', 'index']
+
+# Installs a MutationObserver that bumps a generation counter whenever the
+# document changes, then returns the counter along with the snapshot
+# properties of any elements passed in.  A generation of -1 means that
+# changes can't be observed in this browser.
+_SNAPSHOT_SCRIPT = """
+    var state = window.__webdriverplus_snapshot;
+    if (!state) {
+        state = window.__webdriverplus_snapshot = {
+            token: String(Math.random()).slice(2) + String(new Date().getTime()),
+            generation: 0
+        };
+        var Observer = window.MutationObserver || window.WebKitMutationObserver;
+        if (Observer) {
+            new Observer(function () { state.generation++; }).observe(document, {
+                childList: true, subtree: true, attributes: true, characterData: true
+            });
+        } else {
+            state.generation = -1;
+        }
+    }
+    var values = (function () {
+        %s
+    }).apply(this, arguments);
+    return {token: state.token, generation: state.generation, values: values};
+""" % _PLUCK_SCRIPT
+
+# Waits for a CSS or xpath query to match, re-running it whenever the
+# document changes.  Calls back with the matching elements, or with null
+# on timeout.
+_WAIT_SCRIPT = """
+    var css = arguments[0], xpath = arguments[1], timeout = arguments[2];
+    var callback = arguments[arguments.length - 1];
+    var done = false, observer = null, timer = null, poller = null;
+
+    function query() {
+        var ret = [], i, result;
+        if (css) {
+            result = document.querySelectorAll(css);
+            for (i = 0; i < result.length; i++) {
+                ret.push(result[i]);
+            }
+        } else {
+            result = document.evaluate(xpath, document, null,
+                                       XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            for (i = 0; i < result.snapshotLength; i++) {
+                ret.push(result.snapshotItem(i));
+            }
+        }
+        return ret;
+    }
+
+    function finish(result) {
+        if (done) {
+            return;
+        }
+        done = true;
+        if (observer) {
+            observer.disconnect();
+        }
+        clearTimeout(timer);
+        clearTimeout(poller);
+        callback(result);
+    }
+
+    function check() {
+        var result = query();
+        if (result.length) {
+            finish(result);
+        }
+    }
+
+    function poll() {
+        check();
+        if (!done) {
+            poller = setTimeout(poll, 50);
+        }
+    }
+
+    check();
+    if (!done) {
+        timer = setTimeout(function () { finish(null); }, timeout);
+        var Observer = window.MutationObserver || window.WebKitMutationObserver;
+        if (Observer) {
+            observer = new Observer(check);
+            observer.observe(document, {
+                childList: true, subtree: true, attributes: true, characterData: true
+            });
+        } else {
+            poller = setTimeout(poll, 50);
+        }
+    }
+"""
+
+# Clears storage for the current page, and for the top level page if it
+# is a different, same-origin document (eg. when focused on a frame).
+_CLEAR_STORAGE_SCRIPT = """
+    var windows = [window];
+    try {
+        if (window.top !== window) {
+            windows.push(window.top);
+        }
+    } catch (e) {}
+    for (var i = 0; i < windows.length; i++) {
+        try {
+            windows[i].localStorage.clear();
+            windows[i].sessionStorage.clear();
+        } catch (e) {}
+    }
+"""
+
+# The most alerts that reset() will dismiss, in case dismissing one
+# raises another.
+_MAX_ALERTS = 5
+
+# The script timeout, in seconds, that browsers start with.  Waits restore
+# it afterwards if the user hasn't set one.
+_DEFAULT_SCRIPT_TIMEOUT = 30
+
+# Replaces the current document, without navigating.
+_WRITE_SCRIPT = """
+    document.open();
+    document.write(arguments[0]);
+    document.close();
+"""
+
+# How `open()` loads content.
+_OPEN_MODES = ('file', 'server', 'write')
+
+# Commands that can't change the state of the page.
+_READ_ONLY_COMMANDS = frozenset([
+    Command.FIND_ELEMENT, Command.FIND_ELEMENTS,
+    Command.FIND_CHILD_ELEMENT, Command.FIND_CHILD_ELEMENTS,
+    Command.GET_ELEMENT_TEXT, Command.GET_ELEMENT_TAG_NAME,
+    Command.GET_ELEMENT_ATTRIBUTE, Command.GET_ELEMENT_VALUE_OF_CSS_PROPERTY,
+    Command.IS_ELEMENT_SELECTED, Command.IS_ELEMENT_ENABLED,
+    Command.IS_ELEMENT_DISPLAYED, Command.GET_ELEMENT_LOCATION,
+    Command.GET_ELEMENT_SIZE, Command.GET_CURRENT_URL, Command.GET_TITLE,
+    Command.GET_PAGE_SOURCE, Command.SCREENSHOT, Command.GET_WINDOW_HANDLES,
+    Command.GET_CURRENT_WINDOW_HANDLE, Command.GET_ALL_COOKIES,
+    Command.SET_SCRIPT_TIMEOUT,
+])
+
+# Scripts used internally that don't change the state of the page.
+_READ_ONLY_SCRIPTS = frozenset([
+    _HTML_SCRIPT, _TRAVERSAL_SCRIPT, _FIND_SCRIPT, _SORT_SCRIPT,
+    _MATCHES_SCRIPT, _PLUCK_SCRIPT, _SNAPSHOT_SCRIPT, _WAIT_SCRIPT,
+    _CHAIN_SCRIPT, _CSS_SCRIPT, _FIND_ITER_SCRIPT, _COUNT_SCRIPT, _INDEX_SCRIPT,
+    _CALL_SCRIPTS['attributes'], _INSTALL_AND_CALL_SCRIPTS['attributes'],
+])
+
+
+
+class _LocalState(threading.local):
+    raw = False  # Return script results without converting elements.
+    timer = None  # Times the current command, when profiling.
 
 
 class WebDriverMixin(SelectorMixin):
+    # How long, in seconds, snapshot values are trusted before checking
+    # the page for changes again.
+    _snapshot_max_age = 0.1
+
     def __init__(self, *args, **kwargs):
         self.reuse_browser = kwargs.pop('reuse_browser', False)
         self.quit_on_exit = kwargs.pop('quit_on_exit', False)
         self.wait = kwargs.pop('wait', 0)
+        self.snapshot = kwargs.pop('snapshot', False)
+        self.open_mode = kwargs.pop('open_mode', 'file')
+        assert self.open_mode in _OPEN_MODES, \
+            "'%s' is not a valid open mode." % self.open_mode
         self._highlighted = None
         self._has_quit = False
+        self._snapshot_cache = {}  # element id -> {property: value}
+        self._snapshot_state = None  # (token, generation)
+        self._snapshot_checked = 0
+        self._script_timeout = None  # As last set in the browser.
+        # As set by set_script_timeout(), or the WebDriver default.
+        self._user_script_timeout = _DEFAULT_SCRIPT_TIMEOUT
+        self._pool = None  # Set if the instance belongs to a browser pool.
+        self._page_server = None  # Set once open() has served a page.
+        self._local_state = _LocalState()
+        self._profiles = []  # Active Profile instances.
+        # Set whenever a command that might change the browser's state is
+        # sent, so that reset() knows whether there is anything to do.
+        self._needs_reset = True
+        # True while the browser is on an untouched about:blank page, which
+        # open() can write into without anything leaking from a previous page.
+        self._blank_page = False
         super(WebDriverMixin, self).__init__(*args, **kwargs)
+        self._needs_reset = False
+        self._blank_page = True
+
+    def execute(self, driver_command, params=None):
+        if not self._is_read_only(driver_command, params):
+            self._needs_reset = True
+            self._blank_page = False
+            if self._snapshot_cache:
+                self._snapshot_cache = {}
+                self._snapshot_state = None
+        if not self._profiles:
+            return super(WebDriverMixin, self).execute(driver_command, params)
+
+        sent = params and len(json.dumps(self._wrap_value(params))) or 0
+        timer = _Timer(list(self._profiles), driver_command, sent)
+        self._local_state.timer = timer
+        try:
+            return super(WebDriverMixin, self).execute(driver_command, params)
+        finally:
+            self._local_state.timer = None
+            timer.finish()
+
+    def profile(self, max_commands=None):
+        """
+        Returns a context manager that records the commands sent to the
+        browser, and which API calls sent them.
+        """
+        return Profile(self, max_commands)
+
+    def pipeline(self, commands):
+        """
+        Runs a list of independent (command, params) pairs, and returns the
+        list of their values.  If the instance is using a PooledConnection
+        the commands are sent concurrently, otherwise one after another.
+        """
+        return run_concurrently([
+            lambda command=command, params=params:
+                self.execute(command, params)['value']
+            for command, params in commands
+        ], self._concurrency)
+
+    def _find_wait(self, wait, css=None, **kwargs):
+        """
+        Waits inside the browser for the selector to match, returning as
+        soon as the document changes to include a match.  Falls back to
+        polling with WebDriverWait if the selector can't be run as a script.
+        """
+        if css:
+            kwargs['css'] = css
+        self._check_selector(kwargs)
+        query = self._javascript_enabled and self._get_script_query(kwargs)
+        if not query:
+            return super(WebDriverMixin, self)._find_wait(wait, **kwargs)
+
+        css, xpath = query
+        deadline = time.time() + wait
+        self._use_script_timeout(wait + 5)
+        try:
+            ret = self.execute_async_script(_WAIT_SCRIPT, css, xpath, int(wait * 1000))
+        except WebDriverException:
+            # The script is aborted if the page navigates during the wait,
+            # so poll on the new page for the rest of the time.
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutException(_timeout_message(wait, kwargs))
+            return super(WebDriverMixin, self)._find_wait(remaining, **kwargs)
+        finally:
+            self._use_script_timeout(self._user_script_timeout)
+        if ret is None:
+            raise TimeoutException(_timeout_message(wait, kwargs))
+        return ret
+
+    def set_script_timeout(self, time_to_wait):
+        super(WebDriverMixin, self).set_script_timeout(time_to_wait)
+        self._script_timeout = time_to_wait
+        self._user_script_timeout = time_to_wait
+
+    def _use_script_timeout(self, time_to_wait):
+        """
+        Sets the browser's script timeout, without changing the one set by
+        the user, which waits restore once they finish.
+        """
+        if self._script_timeout != time_to_wait:
+            super(WebDriverMixin, self).set_script_timeout(time_to_wait)
+            self._script_timeout = time_to_wait
+
+    def _iter_matches(self, context, query, chunk_size):
+        """
+        Yields the matches for a (css, xpath) query, in chunks.
+        `context` is a list of elements, or None for the whole document.
+        """
+        css, xpath = query
+        key = None
+        offset = 0
+        try:
+            while True:
+                ret = self.execute_script(_FIND_ITER_SCRIPT, key, context,
+                                          css, xpath, offset, chunk_size)
+                if ret is None:
+                    key = None
+                    raise StaleElementReferenceException(
+                        'The page changed while iterating over the results.')
+                key, done, elems = ret[0], ret[1], ret[2:]
+                if done:
+                    key = None
+                offset += len(elems)
+                for elem in elems:
+                    yield elem
+                if done:
+                    return
+        finally:
+            # Discard the matches if we stopped early.
+            if key is not None:
+                try:
+                    self.execute_script(_FIND_ITER_SCRIPT, key, None,
+                                        css, xpath, 0, 0)
+                except Exception:
+                    pass
+
+    def _count_matches(self, context, query, exists):
+        """
+        Counts the matches for a (css, xpath) query in the browser.
+        `context` is a list of elements, or None for the whole document.
+        """
+        css, xpath = query
+        return self.execute_script(_COUNT_SCRIPT, context, css, xpath, exists,
+                                   raw=True)
+
+    def _is_read_only(self, driver_command, params):
+        if driver_command in _READ_ONLY_COMMANDS:
+            return True
+        script = params.get('script') if params else None
+        return script in _READ_ONLY_SCRIPTS
+
+    # Snapshot mode.
+    # Inspection properties are cached per element, and are invalidated
+    # either when we send a command that might change the page, or when a
+    # MutationObserver in the page tells us that the document has changed.
+    def _snapshot_fetch(self, elem=None, names=()):
+        elems = [elem] if elem is not None else []
+        ret = self.execute_script(_SNAPSHOT_SCRIPT, elems, list(names), raw=True)
+        state = (ret['token'], ret['generation'])
+        if state != self._snapshot_state or ret['generation'] < 0:
+            self._snapshot_cache = {}
+        self._snapshot_state = state
+        self._snapshot_checked = time.time()
+        if elem is None:
+            return None
+        values = ret['values'][0]
+        if ret['generation'] >= 0:
+            self._snapshot_cache.setdefault(elem._id, {}).update(values)
+        return values
+
+    def _snapshot_value(self, elem, name):
+        if elem._id in self._snapshot_cache and \
+           time.time() - self._snapshot_checked > self._snapshot_max_age:
+            self._snapshot_fetch()  # Clears the cache if the page has changed.
+        values = self._snapshot_cache.get(elem._id, {})
+        if name not in values:
+            names = name in _SNAPSHOT_PROPERTIES and _SNAPSHOT_PROPERTIES or [name]
+            values = self._snapshot_fetch(elem, names)
+        return values[name]
 
     def quit(self, force=False):
         if self._has_quit:
             return
         if self.reuse_browser and not force:
-            # alert = self.alert
-            # if alert:
-            #     alert.dismiss()
+            if self._pool is not None:
+                self._pool.checkin(self)
             return
+        if self._pool is not None:
+            self._pool.discard(self)
         super(WebDriverMixin, self).quit()
+        if self._page_server is not None:
+            self._page_server.remove(self)
+        if isinstance(self.command_executor, PooledConnection):
+            self.command_executor.close()
         self._has_quit = True
 
+    def reset(self):
+        """
+        Returns the browser to a clean state, ready to be reused: dismisses
+        any alerts, closes any extra windows, clears cookies and storage
+        for the current page, and navigates to about:blank.
+
+        Does nothing if no commands that might have changed the browser's
+        state have been sent since it was started or last reset.  Called
+        automatically when an instance is returned to the browser pool.
+        """
+        if not self._needs_reset:
+            return
+        for attempt in range(_MAX_ALERTS):
+            try:
+                self.switch_to_alert().dismiss()
+            except WebDriverException:
+                break
+        handles = self.window_handles
+        if len(handles) > 1:
+            for handle in handles[1:]:
+                self.switch_to_window(handle)
+                self.close()
+            self.switch_to_window(handles[0])
+        try:
+            self.delete_all_cookies()
+        except WebDriverException:
+            pass  # Some browsers have no cookies for eg. about:blank
+        self.execute_script(_CLEAR_STORAGE_SCRIPT)
+        self.get('about:blank')
+        self._needs_reset = False
+
+    def _helper(self, name, *args):
+        """
+        Calls one of the helper functions installed on `window.__wdp`,
+        installing them in the same script if the page doesn't have them yet.
+        """
+        ret = self.execute_script(_CALL_SCRIPTS[name], *args)
+        if ret == _HELPERS_MISSING:
+            ret = self.execute_script(_INSTALL_AND_CALL_SCRIPTS[name], *args)
+        return ret
+
     def _highlight(self, elems):
         if self._highlighted:
-            script = """for (var i = 0, j = arguments.length; i < j; i++) {
-                            var elem = arguments[i];
-                            elem.style.backgroundColor = elem.getAttribute('savedBackground');
-                            elem.style.borderColor = elem.getAttribute('savedBorder');
-                            elem.style.outline = elem.getAttribute('savedOutline');
-                        }"""
             try:
-                self.execute_script(script, *self._highlighted)
+                self._helper('unhighlight', self._highlighted)
             except StaleElementReferenceException:
                 pass
 
         self._highlighted = elems
-        script = """
-            for (var i = 0, j = arguments.length; i < j; i++) {
-                var elem = arguments[i];
-                elem.setAttribute('savedBackground', elem.style.backgroundColor);
-                elem.setAttribute('savedBorder', elem.style.borderColor);
-                elem.setAttribute('savedOutline', elem.style.outline);
-                elem.style.backgroundColor = '#f9edbe'
-                elem.style.borderColor = '#f9edbe'
-                elem.style.outline = '1px solid black';
-            }"""
         try:
-            self.execute_script(script, *elems)
+            self._helper('highlight', elems)
         except StaleElementReferenceException:
             pass
 
@@ -61,14 +455,31 @@ class WebDriverMixin(SelectorMixin):
     def _xpath_prefix(self):
         return '//*'
 
-    # Override the default behavior to return our own WebElement and
-    # WebElements objects.
-    def _is_web_element(self, value):
-        return isinstance(value, dict) and 'ELEMENT' in value
+    @property
+    def _script_context(self):
+        return self, None
 
-    def _is_web_element_list(self, lst):
-        return all(isinstance(value, WebElement) for value in lst)
+    @property
+    def _concurrency(self):
+        """
+        How many commands may be sent at once.  Only a PooledConnection
+        can have several requests in flight.
+        """
+        if isinstance(self.command_executor, PooledConnection):
+            return self.command_executor.size
+        return 1
 
+    @property
+    def _javascript_enabled(self):
+        """
+        False if the browser has told us it can't execute scripts,
+        in which case we avoid any of the batched script-based operations.
+        """
+        capabilities = getattr(self, 'capabilities', None) or {}
+        return capabilities.get('javascriptEnabled', True)
+
+    # Override the default behavior to return our own WebElement and
+    # WebElements objects.
     def _create_web_element(self, element_id):
         return WebElement(self, element_id)
 
@@ -76,41 +487,136 @@ class WebDriverMixin(SelectorMixin):
         return WebElementSet(self, elements)
 
     def _unwrap_value(self, value):
-        if self._is_web_element(value):
+        """
+        Converts element references in a response into WebElements, and
+        lists of elements into WebElementSets.  Lists are converted in
+        place, and plain data is returned untouched.
+        """
+        if self._local_state.timer is not None:
+            self._local_state.timer.received = len(json.dumps(value))
+        if isinstance(value, list):
+            if self._local_state.raw:
+                return value
+            return self._unwrap_list(value)
+        if isinstance(value, dict) and 'ELEMENT' in value:
+            if self._local_state.raw:
+                return value
             return self._create_web_element(value['ELEMENT'])
-        elif isinstance(value, list):
-            lst = [self._unwrap_value(item) for item in value]
-            if self._is_web_element_list(lst):
-                return self._create_web_elements(lst)
-            return lst
-        else:
-            return value
+        return value
+
+    def _unwrap_list(self, lst):
+        elements = 0
+        for idx, item in enumerate(lst):
+            if isinstance(item, dict):
+                if 'ELEMENT' in item:
+                    lst[idx] = self._create_web_element(item['ELEMENT'])
+                    elements += 1
+            elif isinstance(item, list):
+                lst[idx] = self._unwrap_list(item)
+        if elements == len(lst):
+            return self._create_web_elements(lst)
+        return lst
 
     def _wrap_value(self, value):
-        if isinstance(value, dict):
-            converted = {}
-            for key, val in value.items():
-                converted[key] = self._wrap_value(val)
-            return converted
-        elif isinstance(value, WebElement):
+        """
+        Converts WebElements in command parameters into element references.
+        Dicts and lists are only copied if they contain elements.
+        """
+        if isinstance(value, WebElement):
             return {'ELEMENT': value._id}  # Use '._id', not '.id'
-        elif isinstance(value, list):
-            return list(self._wrap_value(item) for item in value)
+        elif isinstance(value, dict):
+            converted = None
+            for key, val in value.items():
+                new = self._wrap_value(val)
+                if new is not val:
+                    if converted is None:
+                        converted = dict(value)
+                    converted[key] = new
+            return value if converted is None else converted
+        elif isinstance(value, (list, tuple)):
+            converted = None
+            for idx, val in enumerate(value):
+                new = self._wrap_value(val)
+                if new is not val:
+                    if converted is None:
+                        converted = list(value)
+                    converted[idx] = new
+            return value if converted is None else converted
         else:
             return value
 
+    def execute_script(self, script, *args, **kwargs):
+        """
+        As WebDriver's execute_script(), but if `raw` is set the result
+        is returned as plain JSON data, without converting elements.
+        """
+        if not kwargs.pop('raw', False):
+            return super(WebDriverMixin, self).execute_script(script, *args)
+        self._local_state.raw = True
+        try:
+            return super(WebDriverMixin, self).execute_script(script, *args)
+        finally:
+            self._local_state.raw = False
+
+    def query(self, css=None, **kwargs):
+        """
+        A lazy version of find().  Returns a Query, which records any
+        further finds, traversals and filters, and runs them all with a
+        single script call when the result is first used.
+        """
+        return Query(self).find(css, **kwargs)
+
     # Override get to return self
     def get(self, url):
         super(WebDriverMixin, self).get(url)
+        self._blank_page = url == 'about:blank'
         return self
 
+    @property
+    def _browser_is_local(self):
+        """
+        False if the browser is on another machine, so can't reach servers
+        on this machine's loopback interface.
+        """
+        url = getattr(self.command_executor, '_url', None)
+        if url is None:
+            return True  # In-process, eg. the lxml browser.
+        return urlparse.urlparse(url).hostname in ('localhost', '127.0.0.1', '::1')
+
     # Add some useful shortcuts.
-    def open(self, content):
+    def open(self, content, mode=None):
         """
         Shortcut to open from text.
+
+        `mode` sets how the content is loaded, and defaults to the
+        instance's `open_mode`:
+
+        'file':   Write it to a temporary file, and navigate to that.
+        'server': Serve it from a local in-memory HTTP server, and navigate
+                  to that.  No files are written.  The browser must be on
+                  this machine to reach the server.
+        'write':  Write it into an about:blank page using document.write().
+                  Takes a single script call if the browser is already on
+                  a fresh about:blank page, eg. after reset(), and otherwise
+                  navigates to about:blank first, so that no globals, timers
+                  or listeners are carried over from the previous page.
+                  Falls back to 'file' if the browser can't run scripts.
         """
+        mode = mode or self.open_mode
+        assert mode in _OPEN_MODES, "'%s' is not a valid open mode." % mode
         if not re.match("[^<]*<(html|doctype)", content, re.IGNORECASE):
             content = '<html><head><meta charset="utf-8"></head>%s</html>' % content
+        if mode == 'write' and self._javascript_enabled:
+            if not self._blank_page:
+                self.get('about:blank')
+            self.execute_script(_WRITE_SCRIPT, content)
+            return self
+        if mode == 'server':
+            if not self._browser_is_local:
+                raise Exception("The 'server' open mode needs a browser on this "
+                                "machine, but this one is remote.")
+            self._page_server = get_page_server()
+            return self.get(self._page_server.add(self, content.encode('utf-8')))
         with tempfile.NamedTemporaryFile() as temp:
             temp.write(content.encode('utf-8'))
             temp.flush()
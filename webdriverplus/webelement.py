@@ -2,6 +2,7 @@ from selenium.common.exceptions import StaleElementReferenceException
 from selenium.webdriver.remote.webelement import WebElement as _WebElement
 #from selenium.webdriver.common.action_chains import ActionChains
 
+from webdriverplus.query import Query
 from webdriverplus.selectors import SelectorMixin
 from webdriverplus.utils import get_terminal_size
 from webdriverplus.wrappers import Style, Attributes, Size, Location
@@ -10,71 +11,39 @@ import os
 import sys
 
 
-# http://stackoverflow.com/questions/6157929/how-to-simulate-mouse-click-using-javascript/6158050#6158050
-def simulate_event(event, **options):
-    return """
-    function simulate(element, eventName)
-    {
-        var options = extend(defaultOptions, arguments[2] || {});
-        var oEvent, eventType = null;
+_HTML_SCRIPT = """
+    var container = document.createElement("div");
+    container.appendChild(arguments[0].cloneNode(true));
+    return container.innerHTML;
+"""
 
-        for (var name in eventMatchers)
-        {
-            if (eventMatchers[name].test(eventName)) { eventType = name; break; }
-        }
 
-        if (!eventType)
-            throw new SyntaxError('Only HTMLEvents and MouseEvents interfaces are supported');
-
-        if (document.createEvent)
-        {
-            oEvent = document.createEvent(eventType);
-            if (eventType == 'HTMLEvents')
-            {
-                oEvent.initEvent(eventName, options.bubbles, options.cancelable);
-            }
-            else
-            {
-                oEvent.initMouseEvent(eventName, options.bubbles, options.cancelable, document.defaultView,
-          options.button, options.pointerX, options.pointerY, options.pointerX, options.pointerY,
-          options.ctrlKey, options.altKey, options.shiftKey, options.metaKey, options.button, element);
-            }
-            element.dispatchEvent(oEvent);
-        }
-        else
-        {
-            options.clientX = options.pointerX;
-            options.clientY = options.pointerY;
-            var evt = document.createEventObject();
-            oEvent = extend(evt, options);
-            element.fireEvent('on' + eventName, oEvent);
+# The number of element siblings before arguments[0].
+_INDEX_SCRIPT = """
+    var index = 0;
+    for (var node = arguments[0].previousSibling; node; node = node.previousSibling) {
+        if (node.nodeType === 1) {
+            index++;
         }
-        return element;
     }
+    return index;
+"""
 
-    function extend(destination, source) {
-        for (var property in source)
-          destination[property] = source[property];
-        return destination;
-    }
 
-    var eventMatchers = {
-        'HTMLEvents': /^(?:load|unload|abort|error|select|change|submit|reset|focus|blur|resize|scroll)$/,
-        'MouseEvents': /^(?:click|dblclick|mouse(?:down|up|over|move|out))$/
-    }
-    var defaultOptions = {
-        pointerX: 0,
-        pointerY: 0,
-        button: 0,
-        ctrlKey: false,
-        altKey: false,
-        shiftKey: false,
-        metaKey: false,
-        bubbles: true,
-        cancelable: true
-    }
+def snapshot(func):
+    """
+    Decorator for inspection properties that may be served from the
+    WebDriver's snapshot cache, when snapshot mode is enabled.
+    """
+    name = func.__name__
 
-    simulate(arguments[0], "%s", %s);""" % (event, repr(options))
+    def wrapper(self):
+        if self._parent.snapshot:
+            return self._parent._snapshot_value(self, name)
+        return func(self)
+    wrapper.__name__ = name
+    wrapper.__doc__ = func.__doc__
+    return wrapper
 
 
 class ParentProxy(object):
@@ -98,6 +67,10 @@ class WebElement(SelectorMixin, _WebElement):
     def _xpath_prefix(self):
         return './/*'
 
+    @property
+    def _script_context(self):
+        return self._parent, [self]
+
     @property
     def parent(self):
         """
@@ -106,6 +79,9 @@ class WebElement(SelectorMixin, _WebElement):
         """
         return ParentProxy(self)
 
+    def query(self, css=None, **kwargs):
+        return Query(self._parent, [self]).find(css, **kwargs)
+
     # Traversal
     def _traversal_parent(self, *args, **kwargs):
         ret = self.find(xpath='..')
@@ -139,15 +115,17 @@ class WebElement(SelectorMixin, _WebElement):
         return ret.filter(*args, **kwargs)
 
     def siblings(self, *args, **kwargs):
-        ret = self.prev_all() | self.next_all()
+        ret = self.find(xpath='./preceding-sibling::* | ./following-sibling::*')
         return ret.filter(*args, **kwargs)
 
     # Inspection & Manipulation
     @property
+    @snapshot
     def id(self):
         return self.get_attribute('id')
 
     @property
+    @snapshot
     def type(self):
         return self.get_attribute('type')
 
@@ -172,22 +150,22 @@ class WebElement(SelectorMixin, _WebElement):
         return super(WebElement, self).is_enabled()
 
     @property
+    @snapshot
     def inner_html(self):
         return self.get_attribute('innerHTML')
 
     @property
+    @snapshot
     def html(self):
         # http://stackoverflow.com/questions/1763479/how-to-get-the-html-for-a-dom-element-in-javascript
-        script = """
-            var container = document.createElement("div");
-            container.appendChild(arguments[0].cloneNode(true));
-            return container.innerHTML;
-        """
-        return self._parent.execute_script(script, self)
+        return self._parent.execute_script(_HTML_SCRIPT, self, raw=True)
 
     @property
+    @snapshot
     def index(self):
-        return len(self.prev_all())
+        if not self._parent._javascript_enabled:
+            return len(self.prev_all())
+        return self._parent.execute_script(_INDEX_SCRIPT, self, raw=True)
 
     @property
     def style(self):
@@ -218,23 +196,23 @@ class WebElement(SelectorMixin, _WebElement):
     # Actions...
     # Native events not supported on mac.
     def double_click(self):
-        self._parent.execute_script(simulate_event('dblclick'), self)
+        self._parent._helper('simulate', self, 'dblclick')
         #ActionChains(self._parent).double_click(self).perform()
 
     def context_click(self):
-        self._parent.execute_script(simulate_event('click', button=2), self)
+        self._parent._helper('simulate', self, 'click', {'button': 2})
         #ActionChains(self._parent).double_click(self).perform()
 
     def click_and_hold(self):
-        self._parent.execute_script(simulate_event('mousedown'), self)
+        self._parent._helper('simulate', self, 'mousedown')
         #ActionChains(self._parent).click_and_hold(self).perform()
 
     def release(self):
-        self._parent.execute_script(simulate_event('mouseup'), self)
+        self._parent._helper('simulate', self, 'mouseup')
         #ActionChains(self._parent).click_and_hold(self).perform()
 
     def move_to(self):
-        self._parent.execute_script(simulate_event('mouseover'), self)
+        self._parent._helper('simulate', self, 'mouseover')
         #ActionChains(self._parent).move_to_element(self).perform()
 
     def check(self):
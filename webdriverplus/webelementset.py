@@ -1,6 +1,374 @@
 from webdriverplus.orderedset import OrderedSet
 from webdriverplus.selectors import SelectorMixin
-from webdriverplus.wrappers import Style, Attributes
+from webdriverplus.utils import run_concurrently
+from webdriverplus.wrappers import Style, Attributes, Size, Location, Rect
+
+
+# Shared by the scripts that return a set of elements.  Elements are
+# added with add(), which ignores duplicates and non-elements, and
+# result() returns them in document order.  (Call unmark() instead if
+# the elements aren't needed.)  Set `ret = []` to start
+# a new set.
+_NODE_SET_JS = """
+    var ret = [], mark = '__webdriverplus_seen';
+
+    function add(node) {
+        if (node && node.nodeType === 1 && !node[mark]) {
+            node[mark] = true;
+            ret.push(node);
+        }
+    }
+
+    function unmark() {
+        for (var i = 0; i < ret.length; i++) {
+            try {
+                delete ret[i][mark];
+            } catch (e) {
+                ret[i][mark] = undefined;
+            }
+        }
+    }
+
+    function result() {
+        unmark();
+        ret.sort(function (a, b) {
+            if (a.compareDocumentPosition) {
+                return a.compareDocumentPosition(b) & 4 ? -1 : 1;
+            }
+            return a.sourceIndex - b.sourceIndex;
+        });
+        return ret;
+    }
+"""
+
+# Traversal axes, which add() the related elements of an element.
+_AXES_JS = """
+    function walk(node, direction) {
+        for (node = node[direction]; node; node = node[direction]) {
+            add(node);
+        }
+    }
+
+    function first(node, direction) {
+        for (node = node[direction]; node; node = node[direction]) {
+            if (node.nodeType === 1) {
+                return node;
+            }
+        }
+        return null;
+    }
+
+    var axes = {
+        parent: function (elem) { add(elem.parentNode); },
+        children: function (elem) {
+            for (var node = elem.firstChild; node; node = node.nextSibling) {
+                add(node);
+            }
+        },
+        descendants: function (elem) {
+            var all = elem.getElementsByTagName('*');
+            for (var i = 0; i < all.length; i++) {
+                add(all[i]);
+            }
+        },
+        ancestors: function (elem) { walk(elem, 'parentNode'); },
+        next: function (elem) { add(first(elem, 'nextSibling')); },
+        prev: function (elem) { add(first(elem, 'previousSibling')); },
+        next_all: function (elem) { walk(elem, 'nextSibling'); },
+        prev_all: function (elem) { walk(elem, 'previousSibling'); },
+        siblings: function (elem) {
+            walk(elem, 'previousSibling');
+            walk(elem, 'nextSibling');
+        }
+    };
+"""
+
+# query() adds the elements matching a CSS or xpath query, in the
+# context of the given node.
+_QUERY_JS = """
+    function query(context, css, xpath) {
+        var found, i;
+        if (css) {
+            found = context.querySelectorAll(css);
+            for (i = 0; i < found.length; i++) {
+                add(found[i]);
+            }
+        } else {
+            found = document.evaluate(xpath, context, null,
+                                      XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            for (i = 0; i < found.snapshotLength; i++) {
+                add(found.snapshotItem(i));
+            }
+        }
+    }
+"""
+
+# matches() tests an element against the output of _get_matcher().
+# The xpath query is evaluated once up front, with members().
+_MATCH_JS = """
+    function matchesCSS(elem, css) {
+        var fn = elem.matches || elem.webkitMatchesSelector ||
+                 elem.mozMatchesSelector || elem.msMatchesSelector ||
+                 elem.oMatchesSelector;
+        if (fn) {
+            return fn.call(elem, css);
+        }
+        var all = document.querySelectorAll(css);
+        for (var i = 0; i < all.length; i++) {
+            if (all[i] === elem) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    function members(xpath) {
+        var ret = [];
+        if (xpath) {
+            var snapshot = document.evaluate(xpath, document, null,
+                                             XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            for (var i = 0; i < snapshot.snapshotLength; i++) {
+                ret.push(snapshot.snapshotItem(i));
+            }
+        }
+        return ret;
+    }
+
+    function matches(elem, css, test, xpath, xpathMembers) {
+        if (css && !matchesCSS(elem, css)) {
+            return false;
+        }
+        if (test && !document.evaluate(test, elem, null,
+                                       XPathResult.BOOLEAN_TYPE, null).booleanValue) {
+            return false;
+        }
+        if (xpath) {
+            for (var i = 0; i < xpathMembers.length; i++) {
+                if (xpathMembers[i] === elem) {
+                    return true;
+                }
+            }
+            return false;
+        }
+        return true;
+    }
+"""
+
+_TRAVERSAL_SCRIPT = _NODE_SET_JS + _AXES_JS + """
+    var elems = arguments[0], axis = arguments[1];
+    for (var i = 0; i < elems.length; i++) {
+        axes[axis](elems[i]);
+    }
+    return result();
+"""
+
+_FIND_SCRIPT = _NODE_SET_JS + _QUERY_JS + """
+    var elems = arguments[0], css = arguments[1], xpath = arguments[2];
+    for (var i = 0; i < elems.length; i++) {
+        query(elems[i], css, xpath);
+    }
+    return result();
+"""
+
+# Pages through the matches of a query.  The first call (with a null key)
+# runs the query and keeps the matches in the page.  Each call returns
+# [key, done, elems...] for the next chunk, and the matches are discarded
+# once the last chunk has been returned, or when called with a limit of
+# zero.  Returns null if the matches have gone, eg. because the page has
+# changed.
+_FIND_ITER_SCRIPT = _NODE_SET_JS + _QUERY_JS + """
+    var key = arguments[0], elems = arguments[1], css = arguments[2],
+        xpath = arguments[3], offset = arguments[4], limit = arguments[5];
+    var cache = window.__webdriverplus_results || {};
+    window.__webdriverplus_results = cache;
+
+    if (key === null) {
+        key = String(Math.random()).slice(2) + String(new Date().getTime());
+        elems = elems === null ? [document] : elems;
+        for (var i = 0; i < elems.length; i++) {
+            query(elems[i], css, xpath);
+        }
+        cache[key] = result();
+    }
+    var matches = cache[key];
+    if (!matches || limit === 0) {
+        delete cache[key];
+        return null;
+    }
+    var done = offset + limit >= matches.length;
+    if (done) {
+        delete cache[key];
+    }
+    return [key, done].concat(matches.slice(offset, offset + limit));
+"""
+
+# Counts the distinct matches of a query, or with `exists` set, returns
+# 1 as soon as there is a match and 0 otherwise.
+_COUNT_SCRIPT = _NODE_SET_JS + _QUERY_JS + """
+    var elems = arguments[0], css = arguments[1], xpath = arguments[2],
+        exists = arguments[3], i;
+    elems = elems === null ? [document] : elems;
+
+    if (exists) {
+        for (i = 0; i < elems.length; i++) {
+            if (css ? elems[i].querySelector(css) :
+                      document.evaluate(xpath, elems[i], null,
+                                        XPathResult.FIRST_ORDERED_NODE_TYPE,
+                                        null).singleNodeValue) {
+                return 1;
+            }
+        }
+        return 0;
+    }
+    for (i = 0; i < elems.length; i++) {
+        query(elems[i], css, xpath);
+    }
+    unmark();
+    return ret.length;
+"""
+
+_SORT_SCRIPT = _NODE_SET_JS + """
+    var elems = arguments[0];
+    for (var i = 0; i < elems.length; i++) {
+        add(elems[i]);
+    }
+    return result();
+"""
+
+_MATCHES_SCRIPT = _MATCH_JS + """
+    var elems = arguments[0], css = arguments[1];
+    var test = arguments[2], xpath = arguments[3];
+    var xpathMembers = members(xpath), ret = [];
+    for (var i = 0; i < elems.length; i++) {
+        ret.push(matches(elems[i], css, test, xpath, xpathMembers));
+    }
+    return ret;
+"""
+
+_PLUCK_PROPERTIES = ('text', 'value', 'id', 'type', 'tag_name', 'inner_html',
+                     'html', 'index', 'is_checked', 'is_selected',
+                     'is_enabled', 'location', 'size')
+
+_PLUCK_SCRIPT = """
+    var elems = arguments[0], names = arguments[1];
+    var ret = [], i, j;
+
+    function rect(elem) {
+        var box = elem.getBoundingClientRect();
+        var scrollX = window.pageXOffset || document.documentElement.scrollLeft || 0;
+        var scrollY = window.pageYOffset || document.documentElement.scrollTop || 0;
+        return {x: Math.round(box.left + scrollX), y: Math.round(box.top + scrollY),
+                width: Math.round(box.right - box.left),
+                height: Math.round(box.bottom - box.top)};
+    }
+
+    var getters = {
+        text: function (elem) {
+            var text = elem.innerText;
+            if (typeof text !== 'string') {
+                text = elem.textContent;
+            }
+            return text.replace(/^\\s+|\\s+$/g, '');
+        },
+        tag_name: function (elem) { return elem.tagName.toLowerCase(); },
+        inner_html: function (elem) { return elem.innerHTML; },
+        html: function (elem) {
+            var container = document.createElement('div');
+            container.appendChild(elem.cloneNode(true));
+            return container.innerHTML;
+        },
+        index: function (elem) {
+            var index = 0;
+            for (var node = elem.previousSibling; node; node = node.previousSibling) {
+                if (node.nodeType === 1) {
+                    index++;
+                }
+            }
+            return index;
+        },
+        is_checked: function (elem) { return !!elem.checked; },
+        is_selected: function (elem) { return !!(elem.selected || elem.checked); },
+        is_enabled: function (elem) { return !elem.disabled; },
+        rect: rect,
+        location: rect,
+        size: rect
+    };
+
+    function attribute(elem, name) {
+        var value = elem[name];
+        if (typeof value === 'string' || typeof value === 'number' ||
+            typeof value === 'boolean') {
+            return value;
+        }
+        return elem.getAttribute(name);
+    }
+
+    for (i = 0; i < elems.length; i++) {
+        var record = {};
+        for (j = 0; j < names.length; j++) {
+            var getter = getters[names[j]];
+            record[names[j]] = getter ? getter(elems[i]) : attribute(elems[i], names[j]);
+        }
+        ret.push(record);
+    }
+    return ret;
+"""
+
+# Returns the computed value of a CSS property for each element.  Colours
+# are given as rgba(), to match the values returned by WebDriver.
+_CSS_SCRIPT = """
+    var elems = arguments[0], ret = [];
+    // Accept camelCase names, as WebDriver does, eg. backgroundColor.
+    var name = arguments[1].replace(/[A-Z]/g, function (c) {
+        return '-' + c.toLowerCase();
+    });
+    for (var i = 0; i < elems.length; i++) {
+        var style = window.getComputedStyle(elems[i], null);
+        var value = style.getPropertyValue(name);
+        var rgb = /^rgb\\((\\d+),\\s*(\\d+),\\s*(\\d+)\\)$/.exec(value);
+        if (rgb) {
+            value = 'rgba(' + rgb[1] + ', ' + rgb[2] + ', ' + rgb[3] + ', 1)';
+        }
+        ret.push(value);
+    }
+    return ret;
+"""
+
+# Runs a javascript snippet against each element, as WebElement.javascript()
+# does, so the snippet may end with a semicolon or run several statements.
+_JAVASCRIPT_SCRIPT = """
+    var elems = arguments[0], ret = [];
+    var func = function () {
+        return arguments[0].%s;
+    };
+    for (var i = 0; i < elems.length; i++) {
+        ret.push(func(elems[i]));
+    }
+    return ret;
+"""
+
+# Actions that are simulated with javascript events, as (event, options).
+_SIMULATED_ACTIONS = {
+    'double_click': ('dblclick', {}),
+    'context_click': ('click', {'button': 2}),
+    'click_and_hold': ('mousedown', {}),
+    'release': ('mouseup', {}),
+    'move_to': ('mouseover', {}),
+}
+
+
+class DispatchError(Exception):
+    """
+    Raised when an event couldn't be dispatched to some of the elements
+    in a set.  `errors` is a list of (element, message) tuples.
+    """
+    def __init__(self, event, errors):
+        self.event = event
+        self.errors = errors
+        messages = ['%r: %s' % (elem, message) for elem, message in errors]
+        super(DispatchError, self).__init__(
+            "Failed to dispatch '%s' to %d element(s):\n  %s" %
+            (event, len(errors), '\n  '.join(messages)))
 
 
 class WebElementSet(SelectorMixin, OrderedSet):
@@ -14,11 +382,46 @@ class WebElementSet(SelectorMixin, OrderedSet):
     def _empty(self):
         return WebElementSet(self._webdriver)
 
+    @property
+    def _xpath_prefix(self):
+        return './/*'
+
     def find(self, css=None, **kwargs):
+        """
+        Returns the matching descendants of every element in the set,
+        using a single script call where possible.
+        """
+        if css:
+            kwargs['css'] = css
+        self._check_selector(kwargs)
+        if not self:
+            return self._empty()
+        query = self._webdriver._javascript_enabled and self._get_script_query(kwargs)
+        if query:
+            css, xpath = query
+            return self._webdriver.execute_script(_FIND_SCRIPT, list(self), css, xpath)
+
         ret = self._empty()
         for elem in self:
-            ret |= elem.find(css, **kwargs)
-        return ret
+            ret.update(elem._find_nowait(**kwargs))
+        return ret.sort()
+
+    # Finding in a set never waits, like the single script call above.
+    _find_nowait = find
+
+    def query(self, css=None, **kwargs):
+        from webdriverplus.query import Query
+        return Query(self._webdriver, list(self)).find(css, **kwargs)
+
+    def sort(self):
+        """
+        Reorders the set into document order, using a single script call.
+        """
+        if len(self) > 1 and self._webdriver._javascript_enabled:
+            elems = self._webdriver.execute_script(_SORT_SCRIPT, list(self))
+            # Not self.clear(), which is the action that clears an input.
+            self._keep(list(elems))
+        return self
 
     #def find_all(self, css=None, **kwargs):
     #    ret = WebElementSet(self._webdriver)
@@ -26,15 +429,49 @@ class WebElementSet(SelectorMixin, OrderedSet):
     #        ret |= elem.find_all(css, **kwargs)
     #    return ret
 
+    @property
+    def _script_context(self):
+        return self._webdriver, list(self)
+
+    def _matching(self, css, kwargs):
+        """
+        Returns the elements in the set that match the selector,
+        keeping the existing ordering.
+
+        Each element is tested in the browser, in a single script call,
+        so the cost depends on the size of the set, not of the page.
+        """
+        if css:
+            kwargs['css'] = css
+        if not self:
+            return self._empty()
+        if not self._webdriver._javascript_enabled:
+            others = self._webdriver.find(**kwargs)
+            return WebElementSet(self._webdriver,
+                                 [elem for elem in self if elem in others])
+
+        css, test, xpath, remaining = self._get_matcher(kwargs)
+        ret = self
+        if css or test or xpath:
+            matches = self._webdriver.execute_script(_MATCHES_SCRIPT, list(self),
+                                                     css, test, xpath, raw=True)
+            ret = WebElementSet(self._webdriver,
+                                [elem for elem, match in zip(self, matches) if match])
+        if remaining and ret:
+            others = self._webdriver.find(**remaining)
+            ret = WebElementSet(self._webdriver,
+                                [elem for elem in ret if elem in others])
+        return ret
+
     def filter(self, css=None, **kwargs):
-        if not css or kwargs:
+        if not css and not kwargs:
             return self
-        others = self._webdriver.find(css, **kwargs)
-        return self & others
+        return self._matching(css, kwargs)
 
     def exclude(self, css=None, **kwargs):
-        others = self._webdriver.find(css, **kwargs)
-        return self - others
+        if not css and not kwargs:
+            return self
+        return self - self._matching(css, kwargs)
 
     @property
     def tag_name(self):
@@ -69,6 +506,28 @@ class WebElementSet(SelectorMixin, OrderedSet):
         self._first.move_to()
         return self
 
+    def dispatch(self, event, **options):
+        """
+        Simulates the event on every element in the set, with a single
+        script call.  Raises DispatchError if any of the elements failed.
+        """
+        if not self:
+            return self
+        results = self._webdriver._helper('dispatch', list(self), event, options)
+        errors = [(elem, message) for elem, message in zip(self, results)
+                  if message is not None]
+        if errors:
+            raise DispatchError(event, errors)
+        return self
+
+    @property
+    def each(self):
+        """
+        Applies actions to every element in the set, rather than just the
+        first.  eg. `elems.each.move_to()`
+        """
+        return _Each(self)
+
     def check(self):
         self._first.check()
         return self
@@ -106,7 +565,10 @@ class WebElementSet(SelectorMixin, OrderedSet):
         return self._first.is_checked
 
     def send_keys(self, *value):
-        [elem.send_keys(*value) for elem in self]
+        # One element at a time, so that focus and change events happen
+        # in a predictable order.
+        for elem in self:
+            elem.send_keys(*value)
         return self
 
     @property
@@ -130,7 +592,12 @@ class WebElementSet(SelectorMixin, OrderedSet):
         return self._first.value
 
     def value_of_css_property(self, property_name):
-        return [elem.value_of_css_property(property_name) for elem in self]
+        if not self:
+            return []
+        if not self._webdriver._javascript_enabled:
+            return self._each(lambda elem: elem.value_of_css_property(property_name))
+        return self._webdriver.execute_script(_CSS_SCRIPT, list(self), property_name,
+                                              raw=True)
 
     @property
     def location(self):
@@ -153,7 +620,77 @@ class WebElementSet(SelectorMixin, OrderedSet):
         return Attributes(self._first)
 
     def javascript(self, script):
-        return [elem.javascript(script) for elem in self]
+        if not self:
+            return []
+        if not self._webdriver._javascript_enabled:
+            return self._each(lambda elem: elem.javascript(script))
+        # Convert each result separately, as a list of elements would
+        # otherwise become a single WebElementSet, dropping duplicates.
+        ret = self._webdriver.execute_script(_JAVASCRIPT_SCRIPT % script,
+                                             list(self), raw=True)
+        return [self._webdriver._unwrap_value(item) for item in ret]
+
+    def _each(self, func):
+        """
+        Calls func(elem) for every element, returning the results in order.
+        Calls are made concurrently if the browser's connection allows it.
+        """
+        return run_concurrently([lambda elem=elem: func(elem) for elem in self],
+                                self._webdriver._concurrency)
+
+    def _pluck_each(self, names):
+        """
+        Per-element fallback for pluck(), for browsers without javascript.
+        """
+        ret = []
+        for elem in self:
+            record = {}
+            for name in names:
+                if name == 'rect':
+                    record[name] = Rect(*(elem.location + elem.size))
+                elif name in _PLUCK_PROPERTIES:
+                    record[name] = getattr(elem, name)
+                else:
+                    record[name] = elem.get_attribute(name)
+            ret.append(record)
+        return ret
+
+    def pluck(self, *names):
+        """
+        Returns the named properties of every element in the set, using
+        a single script call.
+
+        Supports 'text', 'value', 'id', 'type', 'tag_name', 'inner_html',
+        'html', 'index', 'is_checked', 'is_selected', 'is_enabled',
+        'location', 'size' and 'rect'.  Any other name is treated as an
+        attribute.
+
+        With a single name, returns a list of values.  With several names,
+        returns a list of dicts, one per element.
+        """
+        assert names, 'no property names supplied.'
+        if not self:
+            return []
+        if self._webdriver._javascript_enabled:
+            records = self._webdriver.execute_script(_PLUCK_SCRIPT, list(self),
+                                                     list(names), raw=True)
+            for record in records:
+                if 'location' in record:
+                    val = record['location']
+                    record['location'] = Location(val['x'], val['y'])
+                if 'size' in record:
+                    val = record['size']
+                    record['size'] = Size(val['width'], val['height'])
+                if 'rect' in record:
+                    val = record['rect']
+                    record['rect'] = Rect(val['x'], val['y'],
+                                          val['width'], val['height'])
+        else:
+            records = self._pluck_each(names)
+
+        if len(names) == 1:
+            return [record[names[0]] for record in records]
+        return records
 
     def __repr__(self):
         ret = "WebElementSet(\n  %s\n)" % '\n  '.join([repr(elem) for elem in self])
@@ -167,63 +704,83 @@ class WebElementSet(SelectorMixin, OrderedSet):
         return ret
 
     # Traversal
-    def parent(self, *args, **kwargs):
+    def _traverse(self, axis):
+        """
+        Returns the union of `axis` ('children', 'parent' etc...) for every
+        element in the set, deduplicated and in document order.
+
+        The whole set is walked in a single script call if the browser
+        supports it, otherwise we fall back to one query per element.
+        """
+        if not self:
+            return self._empty()
+        if self._webdriver._javascript_enabled:
+            return self._webdriver.execute_script(_TRAVERSAL_SCRIPT,
+                                                  list(self), axis)
         ret = self._empty()
         for elem in self:
-            ret |= elem.parent()
+            ret.update(getattr(elem, axis)())
+        return ret.sort()
+
+    def parent(self, *args, **kwargs):
+        ret = self._traverse('parent')
         return ret.filter(*args, **kwargs)
 
     def children(self, *args, **kwargs):
-        ret = self._empty()
-        for elem in self:
-            ret |= elem.children()
+        ret = self._traverse('children')
         return ret.filter(*args, **kwargs)
 
     def descendants(self):
-        ret = self._empty()
-        for elem in self:
-            ret |= elem.descendants()
-        return ret
+        return self._traverse('descendants')
 
     def ancestors(self, *args, **kwargs):
-        ret = self._empty()
-        for elem in self:
-            ret |= elem.ancestors()
+        ret = self._traverse('ancestors')
         return ret.filter(*args, **kwargs)
 
     def next(self, *args, **kwargs):
-        ret = self._empty()
-        for elem in self:
-            ret |= elem.next()
+        ret = self._traverse('next')
         return ret.filter(*args, **kwargs)
 
     def prev(self, *args, **kwargs):
-        ret = self._empty()
-        for elem in self:
-            ret |= elem.prev()
+        ret = self._traverse('prev')
         return ret.filter(*args, **kwargs)
 
     def next_all(self, *args, **kwargs):
-        ret = self._empty()
-        for elem in self:
-            ret |= elem.next_all()
+        ret = self._traverse('next_all')
         return ret.filter(*args, **kwargs)
 
     def prev_all(self, *args, **kwargs):
-        ret = self._empty()
-        for elem in self:
-            ret |= elem.prev_all()
+        ret = self._traverse('prev_all')
         return ret.filter(*args, **kwargs)
 
     def siblings(self, *args, **kwargs):
-        ret = self._empty()
-        for elem in self:
-            ret |= elem.siblings()
+        ret = self._traverse('siblings')
         return ret.filter(*args, **kwargs)
 
     def __getitem__(self, key):
         if isinstance(key, slice):
-            elems = list(self)[key]
+            elems = self._items[key]
         else:
-            elems = [list(self)[key]]
+            elems = [self._items[key]]
         return WebElementSet(self._webdriver, elems)
+
+
+class _Each(object):
+    def __init__(self, elems):
+        self._elems = elems
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in _SIMULATED_ACTIONS:
+            event, options = _SIMULATED_ACTIONS[name]
+
+            def action():
+                return self._elems.dispatch(event, **options)
+        else:
+            def action(*args, **kwargs):
+                for elem in self._elems:
+                    getattr(elem, name)(*args, **kwargs)
+                return self._elems
+        action.__name__ = name
+        return action
@@ -5,6 +5,8 @@ Size = namedtuple('Size', ['width', 'height'])
 
 Location = namedtuple('Location', ['x', 'y'])
 
+Rect = namedtuple('Rect', ['x', 'y', 'width', 'height'])
+
 
 class Style(object):
     """
@@ -23,7 +25,6 @@ class Style(object):
 
 
 # http://thatmattbone.com/2010/04/delaying-computation-lazy-dictionaries-in-python/
-# http://stackoverflow.com/questions/2048720/get-all-attributes-from-a-html-element-with-javascript-jquery
 class Attributes(object):
     """
     Allows getting, setting and deleting attributes.
@@ -33,14 +34,7 @@ class Attributes(object):
         self._elem = elem
 
     def _get_attributes(self):
-        script = """
-        var elem = arguments[0];
-        var ret = {}
-        for (var i=0, attrs=elem.attributes, l=attrs.length; i<l; i++){
-            ret[attrs.item(i).nodeName] = attrs.item(i).nodeValue
-        }
-        return ret"""
-        return self._elem._parent.execute_script(script, self._elem)
+        return self._elem._parent._helper('attributes', self._elem)
 
     def __getitem__(self, name):
         return self._elem.javascript("getAttribute('%s')" % name)